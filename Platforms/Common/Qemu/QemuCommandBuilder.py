@@ -9,207 +9,390 @@
 """QEMU Command Builder for Q35 and ARM Virt architectures"""
 
 import os
+import stat
+import sys
 import logging
 import datetime
+import functools
 from pathlib import Path
-from enum import Enum
+from dataclasses import dataclass
+from enum import IntEnum
+from types import MappingProxyType
 
 
-class QemuArchitecture(Enum):
+class QemuArchitecture(IntEnum):
     """Supported QEMU architectures"""
 
-    Q35 = "q35"
-    ARM_VIRT = "arm-virt"
+    Q35 = 0
+    ARM_VIRT = 1
+
+
+# Architecture names, as used by the former string enum values
+_ARCH_NAMES = {
+    QemuArchitecture.Q35: "q35",
+    QemuArchitecture.ARM_VIRT: "arm-virt",
+}
+
+
+@functools.lru_cache(maxsize=1)
+def _smbios_date(ordinal):
+    """Format a date ordinal as the MM/DD/YYYY string used by SMBIOS type 0"""
+    return datetime.date.fromordinal(ordinal).strftime("%m/%d/%Y")
+
+
+def _stat_mode(path):
+    """Return the st_mode of path, or 0 if it cannot be stat'ed"""
+    try:
+        return os.stat(path).st_mode
+    except (OSError, ValueError):
+        return 0
+
+
+# Option flags shared by many sections
+_OPT_DEVICE = sys.intern("-device")
+_OPT_DRIVE = sys.intern("-drive")
+_OPT_GLOBAL = sys.intern("-global")
+_OPT_SMBIOS = sys.intern("-smbios")
+_OPT_MACHINE = sys.intern("-machine")
+_OPT_CPU = sys.intern("-cpu")
+_OPT_NETDEV = sys.intern("-netdev")
+
+
+# Default SMBIOS values for each architecture, see `with_smbios`
+_SMBIOS_DEFAULTS_Q35 = MappingProxyType({
+    # Type 0 (BIOS Information)
+    "smbios0_vendor": "Patina",
+    "smbios0_version": "patina-q35-patched",
+    "smbios0_date": None,  # current date, filled in when rendered
+    # Type 1 (System Information)
+    "smbios1_manufacturer": "OpenDevicePartnership",
+    "smbios1_product": "QEMU Q35",
+    "smbios1_family": "QEMU",
+    "smbios1_version": "10.0.0",
+    "smbios1_serial": "42-42-42-42",
+    "smbios1_uuid": "99fb60e2-181c-413a-a3cf-0a5fea8d87b0",
+    # Type 3 (Chassis Information)
+    "smbios3_manufacturer": "OpenDevicePartnership",
+    "smbios3_serial": "40-41-42-43",
+    "smbios3_asset": "Q35",
+    "smbios3_sku": "Q35",
+    "smbios3_version": "",
+})
+
+_SMBIOS_DEFAULTS_ARM_VIRT = MappingProxyType({
+    # Type 0 (BIOS Information)
+    "smbios0_vendor": "Patina",
+    "smbios0_version": "patina-armvirt-patched",
+    "smbios0_date": None,  # current date, filled in when rendered
+    # Type 1 (System Information)
+    "smbios1_manufacturer": "OpenDevicePartnership",
+    "smbios1_product": "QEMU ARM Virt",
+    "smbios1_family": "QEMU",
+    "smbios1_version": "10.0.0",
+    "smbios1_serial": "42-42-42-42",
+    "smbios1_uuid": "99fb60e2-181c-413a-a3cf-0a5fea8d87b0",
+    # Type 3 (Chassis Information)
+    "smbios3_manufacturer": "OpenDevicePartnership",
+    "smbios3_serial": "42-42-42-42",
+    "smbios3_asset": "ARM Virt",
+    "smbios3_sku": "ARM Virt",
+    "smbios3_version": "",
+})
+
+
+# SMBIOS option values, filled in from the `with_smbios` values
+_SMBIOS0_TEMPLATE = (
+    'type=0,vendor={smbios0_vendor},version={smbios0_version},'
+    'date={smbios0_date},uefi=on'
+)
+_SMBIOS1_TEMPLATE = (
+    'type=1,manufacturer={smbios1_manufacturer},product={smbios1_product},'
+    'family={smbios1_family},version={smbios1_version},'
+    'serial={smbios1_serial},uuid={smbios1_uuid}'
+)
+_SMBIOS3_TEMPLATE = (
+    'type=3,manufacturer={smbios3_manufacturer},serial={smbios3_serial},'
+    'asset={smbios3_asset},sku={smbios3_sku},version={smbios3_version}'
+)
+
+
+# CPU configuration for each architecture, see `with_cpu`
+_Q35_CPU_FEATURES = ",+rdrand,+umip,+smep,+pdpe1gb,+popcnt,+sse,+sse2,+sse3,+ssse3,+sse4.2,+sse4.1"
+_Q35_CPU_DEFAULT = "qemu64" + _Q35_CPU_FEATURES
+_ARM_VIRT_CPU = "max,sve=off,sme=off"
+
+# Accelerators accepted by `with_machine`
+_VALID_ACCELERATORS = frozenset(("kvm", "tcg", "whpx"))
+
+# QEMU drive format for each storage file extension, see `with_storage`
+_STORAGE_FORMATS = {
+    ".vhd": "raw",
+    ".qcow2": "qcow2",
+    ".iso": "iso",
+}
+
+
+# Constant parts of the drive option values
+_PFLASH_UNIT0_PREFIX = "if=pflash,format=raw,unit=0,file="
+_PFLASH_UNIT1_PREFIX = "if=pflash,format=raw,unit=1,file="
+_READONLY_SUFFIX = ",readonly=on"
+_USB_DRIVE_SUFFIX = ",media=disk,if=none,id="
+_USB_STORAGE_DEVICE_PREFIX = "usb-storage,bus=usb.0,drive="
+
+
+@dataclass(frozen=True, slots=True)
+class _ArchTemplates:
+    """Architecture specific pieces of the QEMU command line"""
+
+    init_args: tuple  # common initial arguments
+    machine: str
+    machine_accel: bool  # whether `machine` accepts an accel= option
+    cpu_default: str
+    cpu_features: str | None  # appended to a model override, None ignores overrides
+    firmware_code_suffix: str
+    firmware_vars_suffix: str
+    smbios_defaults: MappingProxyType
+    tpm_device: str
+    display_args: tuple
+
+
+_Q35_TEMPLATES = _ArchTemplates(
+    init_args=(
+        "-debugcon", "stdio",  # enable debug console
+        _OPT_GLOBAL, "ICH9-LPC.disable_s3=1",  # disable S3 sleep state
+        _OPT_GLOBAL, "isa-debugcon.iobase=0x402",  # debug console
+        _OPT_DEVICE, "isa-debug-exit,iobase=0xf4,iosize=0x04",  # debug exit device
+    ),
+    machine="q35,smm=on",
+    machine_accel=True,
+    cpu_default=_Q35_CPU_DEFAULT,
+    cpu_features=_Q35_CPU_FEATURES,
+    # CODE is readonly, VARS is writable
+    firmware_code_suffix=_READONLY_SUFFIX,
+    firmware_vars_suffix="",
+    smbios_defaults=_SMBIOS_DEFAULTS_Q35,
+    tpm_device="tpm-tis,tpmdev=tpm0",
+    display_args=(_OPT_DEVICE, "bochs-display,addr=0x03", "-vga", "none"),
+)
+
+_ARM_VIRT_TEMPLATES = _ArchTemplates(
+    init_args=("-semihosting",),
+    machine="virt,secure=on,virtualization=on,gic-version=3,mte=on,iommu=smmuv3",
+    machine_accel=False,
+    cpu_default=_ARM_VIRT_CPU,
+    cpu_features=None,
+    # Unit 0: SECURE_FLASH0.fd (writable)
+    # Unit 1: QEMU_EFI.fd (readonly)
+    firmware_code_suffix="",
+    firmware_vars_suffix=_READONLY_SUFFIX,
+    smbios_defaults=_SMBIOS_DEFAULTS_ARM_VIRT,
+    tpm_device="tpm-tis-device,tpmdev=tpm0",
+    # Pin to a fixed PCI slot so the firmware's preferred-video
+    # device path stays stable regardless of how many other PCI
+    # devices precede it on the command line.
+    display_args=(_OPT_DEVICE, "bochs-display,addr=0x1f"),
+)
+
+_ARCH_TEMPLATES = {
+    QemuArchitecture.Q35: _Q35_TEMPLATES,
+    QemuArchitecture.ARM_VIRT: _ARM_VIRT_TEMPLATES,
+}
 
 
 class QemuCommandBuilder:
-    """Builder class for constructing QEMU command arguments"""
+    """Builder class for constructing QEMU command arguments
+
+    The `with_*` methods only record their inputs as sections. The argument
+    list is rendered by `build()`, in the order the sections were added, and
+    cached until another section is added.
+    """
+
+    __slots__ = (
+        "_logger",
+        "_executable",
+        "_architecture",
+        "_tpl",
+        "_sections",
+        "_built_cache",
+        "_added_mask",
+        "_usb_storage_index",
+    )
+
+    # Idempotent tracking bits for `_added_mask`
+    _F_ROM_PATH = 1 << 0
+    _F_MACHINE = 1 << 1
+    _F_CPU = 1 << 2
+    _F_FIRMWARE = 1 << 3
+    _F_USB_CONTROLLER = 1 << 4
+    _F_USB_MOUSE = 1 << 5
+    _F_USB_KEYBOARD = 1 << 6
+    _F_MEMORY = 1 << 7
+    _F_NETWORK = 1 << 8
+    _F_SMBIOS = 1 << 9
+    _F_TPM = 1 << 10
+    _F_DISPLAY = 1 << 11
+    _F_GDB_SERVER = 1 << 12
+    _F_SERIAL_PORT = 1 << 13
+    _F_MONITOR_PORT = 1 << 14
 
     def __init__(self, executable, architecture=QemuArchitecture.Q35):
         self._logger = logging.getLogger(__name__)
         self._executable = executable
         self._architecture = architecture
-        self._args = []
+        self._tpl = _ARCH_TEMPLATES[architecture]
+        self._sections = {}
+        self._built_cache = None
 
         # Idempotent tracking flags
-        self._rom_path_added = False
-        self._machine_added = False
-        self._cpu_added = False
-        self._firmware_added = False
-        self._usb_controller_added = False
-        self._usb_mouse_added = False
-        self._usb_keyboard_added = False
+        self._added_mask = 0
         self._usb_storage_index = 0
-        self._memory_added = False
-        self._network_added = False
-        self._smbios_added = False
-        self._tpm_added = False
-        self._display_added = False
-        self._gdb_server_added = False
-        self._serial_port_added = False
-        self._monitor_port_added = False
 
         # Common initial arguments
-        if self._architecture == QemuArchitecture.Q35:
-            self._args.extend(["-debugcon", "stdio"])  # enable debug console
-            self._args.extend(
-                ["-global", "ICH9-LPC.disable_s3=1"]
-            )  # disable S3 sleep state
-            self._args.extend(
-                ["-global", "isa-debugcon.iobase=0x402"]
-            )  # debug console
-            self._args.extend(
-                ["-device", "isa-debug-exit,iobase=0xf4,iosize=0x04"]
-            )  # debug exit device
-        elif self._architecture == QemuArchitecture.ARM_VIRT:
-            self._args.extend(["-semihosting"])
+        self._add_section("init", QemuCommandBuilder._render_init)
+
+    def _add_section(self, key, render, *inputs):
+        """Record a section that `build()` renders as `render(self, *inputs)`
+
+        Sections that may be added more than once pass `None` as the key and
+        get a unique one.
+        """
+        if key is None:
+            key = len(self._sections)
+        self._sections[key] = (render, inputs)
+        self._built_cache = None
+
+    def _add_once(self, bit, key, render, *inputs):
+        """Add a section unless `bit` is already set in `_added_mask`
+
+        Returns:
+            bool: True if the section was added, False if it was skipped.
+        """
+        if self._added_mask & bit:
+            self._logger.debug("%s already configured, skipping", key)
+            return False
+
+        self._added_mask |= bit
+        self._add_section(key, render, *inputs)
+        return True
+
+    def _render_init(self):
+        return self._tpl.init_args
 
     def with_rom_path(self, rom_dir):
         """Set ROM path for QEMU external dependency"""
-        if self._rom_path_added:
-            self._logger.debug("ROM path already added, skipping")
-            return self
-
         if not rom_dir:
             return self
 
-        self._rom_path_added = True
-        self._logger.debug(f"Setting ROM path to: {rom_dir}")
-        self._args.extend(["-L", f"{str(Path(rom_dir))}"])
+        if self._add_once(self._F_ROM_PATH, "rom_path", QemuCommandBuilder._render_rom_path, rom_dir):
+            self._logger.debug("Setting ROM path to: %s", rom_dir)
         return self
 
+    def _render_rom_path(self, rom_dir):
+        # A string that already uses the native separator needs no Path round-trip
+        if not (isinstance(rom_dir, str) and os.sep in rom_dir):
+            rom_dir = str(Path(rom_dir))
+        return ("-L", rom_dir)
+
     def with_machine(self, accel=None):
         """Configure machine type with SMM and acceleration"""
-        if self._machine_added:
-            self._logger.debug("Machine already configured, skipping")
-            return self
-
-        self._machine_added = True
-        if self._architecture == QemuArchitecture.Q35:
-            machine_config = f"q35,smm=on"
-
-            if accel:
-                accel_lower = accel.lower()
-                if accel_lower in ["kvm", "tcg", "whpx"]:
-                    machine_config += f",accel={accel_lower}"
+        self._add_once(self._F_MACHINE, "machine", QemuCommandBuilder._render_machine, accel)
+        return self
 
-            self._args.extend(["-machine", machine_config])
-        elif self._architecture == QemuArchitecture.ARM_VIRT:
-            self._args.extend(["-machine", "virt,secure=on,virtualization=on,gic-version=3,mte=on,iommu=smmuv3"])
+    def _render_machine(self, accel):
+        machine_config = self._tpl.machine
 
-        self._args.extend(
-                ["-global", "driver=cfi.pflash01,property=secure,value=on"]
-            )
+        if accel and self._tpl.machine_accel:
+            accel_lower = accel.lower()
+            if accel_lower in _VALID_ACCELERATORS:
+                machine_config += f",accel={accel_lower}"
 
-        return self
+        return (
+            _OPT_MACHINE,
+            machine_config,
+            _OPT_GLOBAL,
+            "driver=cfi.pflash01,property=secure,value=on",
+        )
 
     def with_cpu(self, model=None, core_count=None):
         """Configure CPU model and core count"""
-        if self._cpu_added:
-            self._logger.debug("CPU already configured, skipping")
-            return self
+        self._add_once(self._F_CPU, "cpu", QemuCommandBuilder._render_cpu, model, core_count)
+        return self
 
-        self._cpu_added = True
-        if self._architecture == QemuArchitecture.Q35:
-            cpu_model = model or "qemu64"
-            cpu_features = f"{cpu_model},+rdrand,+umip,+smep,+pdpe1gb,+popcnt,+sse,+sse2,+sse3,+ssse3,+sse4.2,+sse4.1"
-            self._args.extend(["-cpu", cpu_features])
-        elif self._architecture == QemuArchitecture.ARM_VIRT:
-            self._args.extend(["-cpu", "max,sve=off,sme=off"])
+    def _render_cpu(self, model, core_count):
+        if model and self._tpl.cpu_features is not None:
+            cpu_features = model + self._tpl.cpu_features
+        else:
+            cpu_features = self._tpl.cpu_default
+        args = [_OPT_CPU, cpu_features]
 
         if core_count:
-            self._args.extend(["-smp", str(core_count)])
+            args += ("-smp", str(core_count))
 
-        return self
+        return args
 
     def with_firmware(self, code_fd, vars_fd=None):
         """Configure firmware (CODE and VARS)"""
-        if self._firmware_added:
-            self._logger.debug("Firmware already configured, skipping")
-            return self
-
         if not code_fd:
             return self
 
-        self._firmware_added = True
-        self._logger.debug(
-            "Configuring firmware - CODE: %s, VARS: %s", code_fd, vars_fd
-        )
-
-        if self._architecture == QemuArchitecture.Q35:
-            self._args.extend(
-                [
-                    "-drive",
-                    f"if=pflash,format=raw,unit=0,file={str(code_fd)},readonly=on",
-                    "-drive",
-                    f"if=pflash,format=raw,unit=1,file={str(vars_fd)}",
-                ]
-            )
-        elif self._architecture == QemuArchitecture.ARM_VIRT:
-            # Unit 0: SECURE_FLASH0.fd (writable)
-            # Unit 1: QEMU_EFI.fd (readonly)
-            self._args.extend(
-                [
-                    "-drive",
-                    f"if=pflash,format=raw,unit=0,file={str(code_fd)}",
-                    "-drive",
-                    f"if=pflash,format=raw,unit=1,file={str(vars_fd)},readonly=on",
-                 ]
+        if self._add_once(
+            self._F_FIRMWARE, "firmware", QemuCommandBuilder._render_firmware, code_fd, vars_fd
+        ):
+            self._logger.debug(
+                "Configuring firmware - CODE: %s, VARS: %s", code_fd, vars_fd
             )
-
         return self
 
+    def _render_firmware(self, code_fd, vars_fd):
+        return (
+            _OPT_DRIVE,
+            "".join((_PFLASH_UNIT0_PREFIX, str(code_fd), self._tpl.firmware_code_suffix)),
+            _OPT_DRIVE,
+            "".join((_PFLASH_UNIT1_PREFIX, str(vars_fd), self._tpl.firmware_vars_suffix)),
+        )
+
     def with_usb_controller(self):
         """Add USB controller"""
-        if self._usb_controller_added:
-            self._logger.debug("USB controller already added, skipping")
-            return self
+        self._add_once(self._F_USB_CONTROLLER, "usb_controller", QemuCommandBuilder._render_usb_controller)
+        return self
 
-        self._usb_controller_added = True
-        self._args.extend(
-            [
-                "-device",
-                "qemu-xhci,id=usb",
-            ]
+    def _render_usb_controller(self):
+        return (
+            _OPT_DEVICE,
+            "qemu-xhci,id=usb",
         )
 
-        return self
-
     def with_usb_mouse(self):
         """Add USB mouse device"""
-        if self._usb_mouse_added:
-            self._logger.debug("USB mouse already added, skipping")
-            return self
-
-        if not self._usb_controller_added:
-            self = self.with_usb_controller()
+        if not self._added_mask & self._F_USB_CONTROLLER:
+            self.with_usb_controller()
 
-        self._usb_mouse_added = True
         # `usb-tablet` uses absolute coordinates and allows QEMU
         # to report the mouse position without grabbing the device.
-        self._args.extend(["-device", "usb-tablet,id=input0,bus=usb.0,port=1"])
+        self._add_once(self._F_USB_MOUSE, "usb_mouse", QemuCommandBuilder._render_usb_mouse)
         return self
 
+    def _render_usb_mouse(self):
+        return (_OPT_DEVICE, "usb-tablet,id=input0,bus=usb.0,port=1")
+
     def with_usb_keyboard(self):
         """Add USB keyboard device"""
-        if self._usb_keyboard_added:
-            self._logger.debug("USB keyboard already added, skipping")
-            return self
-
-        if not self._usb_controller_added:
-            self = self.with_usb_controller()
+        if not self._added_mask & self._F_USB_CONTROLLER:
+            self.with_usb_controller()
 
-        self._usb_keyboard_added = True
-        self._args.extend(["-device", "usb-kbd,id=input1,bus=usb.0,port=2"])
+        self._add_once(self._F_USB_KEYBOARD, "usb_keyboard", QemuCommandBuilder._render_usb_keyboard)
         return self
 
+    def _render_usb_keyboard(self):
+        return (_OPT_DEVICE, "usb-kbd,id=input1,bus=usb.0,port=2")
+
     def with_usb_storage(self, drive_file, drive_id=None, drive_format="raw"):
         """Add USB storage device"""
         if not drive_file:
             return self
 
-        if not self._usb_controller_added:
-            self = self.with_usb_controller()
+        if not self._added_mask & self._F_USB_CONTROLLER:
+            self.with_usb_controller()
 
         # Auto-generate unique ID if not provided
         if not drive_id:
@@ -217,30 +400,37 @@ class QemuCommandBuilder:
             self._usb_storage_index += 1
 
         self._logger.debug(
-            f"Adding USB storage device: {drive_file} (id={drive_id}, format={drive_format})"
+            "Adding USB storage device: %s (id=%s, format=%s)",
+            drive_file,
+            drive_id,
+            drive_format,
         )
 
-        if os.path.isfile(drive_file):
-            self._args.extend(
-                [
-                    "-drive",
-                    f"file={drive_file},format={drive_format},media=disk,if=none,id={drive_id}",
-                    "-device",
-                    f"usb-storage,bus=usb.0,drive={drive_id}",
-                ]
+        mode = _stat_mode(drive_file)
+        if stat.S_ISREG(mode):
+            self._add_section(
+                None, QemuCommandBuilder._render_usb_storage,
+                f"{drive_file}", drive_id, drive_format,
             )
-        elif os.path.isdir(drive_file):
-            self._args.extend(
-                [
-                    "-drive",
-                    f"file=fat:rw:{drive_file},format={drive_format},media=disk,if=none,id={drive_id}",
-                    "-device",
-                    f"usb-storage,bus=usb.0,drive={drive_id}",
-                ]
+        elif stat.S_ISDIR(mode):
+            self._add_section(
+                None, QemuCommandBuilder._render_usb_storage,
+                f"fat:rw:{drive_file}", drive_id, drive_format,
             )
 
         return self
 
+    def _render_usb_storage(self, drive_spec, drive_id, drive_format):
+        drive_id = str(drive_id)
+        return (
+            _OPT_DRIVE,
+            "".join((
+                "file=", drive_spec, ",format=", str(drive_format), _USB_DRIVE_SUFFIX, drive_id
+            )),
+            _OPT_DEVICE,
+            "".join((_USB_STORAGE_DEVICE_PREFIX, drive_id)),
+        )
+
     def with_virtual_drive(self, virtual_drive):
         """Mount virtual drive(Vhd, qcow2 img or directory)
         Args:
@@ -253,15 +443,19 @@ class QemuCommandBuilder:
         if not virtual_drive:
             return self
 
-        if os.path.isfile(virtual_drive):
-            self._logger.debug(f"Mounting virtual drive file: {virtual_drive}")
-            self._args.extend(["-drive", f"file={virtual_drive},if=virtio"])
-        elif os.path.isdir(virtual_drive):
+        mode = _stat_mode(virtual_drive)
+        if stat.S_ISREG(mode):
+            self._logger.debug("Mounting virtual drive file: %s", virtual_drive)
+            self._add_section(
+                None, QemuCommandBuilder._render_drive, f"file={virtual_drive},if=virtio"
+            )
+        elif stat.S_ISDIR(mode):
             self._logger.debug(
                 "Mounting virtual drive directory as FAT filesystem: %s", virtual_drive
             )
-            self._args.extend(
-                ["-drive", f"file=fat:rw:{virtual_drive},format=raw,media=disk"]
+            self._add_section(
+                None, QemuCommandBuilder._render_drive,
+                f"file=fat:rw:{virtual_drive},format=raw,media=disk",
             )
         else:
             self._logger.error(
@@ -271,16 +465,17 @@ class QemuCommandBuilder:
 
         return self
 
+    def _render_drive(self, drive_config):
+        return (_OPT_DRIVE, drive_config)
+
     def with_memory(self, size_mb):
         """Set memory size in MB"""
-        if self._memory_added:
-            self._logger.debug("Memory already configured, skipping")
-            return self
-
-        self._memory_added = True
-        self._args.extend(["-m", str(size_mb)])
+        self._add_once(self._F_MEMORY, "memory", QemuCommandBuilder._render_memory, size_mb)
         return self
 
+    def _render_memory(self, size_mb):
+        return ("-m", str(size_mb))
+
     def with_storage(self, path: os.PathLike, device: str):
         """Attaches storage to a device to be accessible by QEMU.
 
@@ -297,33 +492,35 @@ class QemuCommandBuilder:
         if not path:
             return self
 
-        self._logger.debug(f"Configuring storage: {path}")
+        self._logger.debug("Configuring storage: %s", path)
 
-        path = Path(path)
+        path = os.fspath(path)
         device = device.lower()
 
-        format = {
-            ".vhd": "raw",
-            ".qcow2": "qcow2",
-            ".iso": "iso"
-        }.get(path.suffix)
+        format = _STORAGE_FORMATS.get(os.path.splitext(path)[1].lower())
 
         if device == "cdrom" and format == "iso":
-            self._args.extend(["-cdrom", f"{str(path)}"])
+            self._add_section(None, QemuCommandBuilder._render_cdrom, path)
         elif device == "usb":
             self = self.with_usb_storage(path, drive_format = format)
         elif device == "ssd":
-            self._args.extend([
-                "-drive",
-                f"file={path},format={format},if=none,id=os_nvme",
-                "-device",
-                "nvme,serial=nvme-1,drive=os_nvme",
-            ])
+            self._add_section(None, QemuCommandBuilder._render_nvme, path, format)
         else:
-            raise Exception(f"Unsupported storage combination: {device} && {format} && {self._architecture}")
+            raise Exception(f"Unsupported storage combination: {device} && {format} && {_ARCH_NAMES[self._architecture]}")
 
         return self
 
+    def _render_cdrom(self, path):
+        return ("-cdrom", path)
+
+    def _render_nvme(self, path, format):
+        return (
+            _OPT_DRIVE,
+            f"file={path},format={format},if=none,id=os_nvme",
+            _OPT_DEVICE,
+            "nvme,serial=nvme-1,drive=os_nvme",
+        )
+
     def with_network(self, enabled=True, forward_ports=None, use_virtio=False):
         """Configure network device with user mode networking
 
@@ -340,33 +537,41 @@ class QemuCommandBuilder:
                 - False: Uses e1000 device (broader compatibility, standard Ethernet emulation)
                 (ignored when enabled=False)
         """
-        if self._network_added:
-            self._logger.debug("Network already configured, skipping")
-            return self
+        if enabled and forward_ports:
+            # Rendering is deferred to build(), so keep a copy the caller cannot change
+            forward_ports = tuple(forward_ports)
+
+        if self._add_once(
+            self._F_NETWORK, "network", QemuCommandBuilder._render_network,
+            enabled, forward_ports, use_virtio,
+        ):
+            if not enabled:
+                self._logger.debug("Networking disabled")
+            elif forward_ports:
+                self._logger.debug("Configuring port forwarding: %s", forward_ports)
+        return self
 
-        self._network_added = True
+    def _render_network(self, enabled, forward_ports, use_virtio):
         if not enabled:
-            self._logger.debug("Networking disabled")
-            self._args.extend(["-net", "none"])
-            return self
+            return ("-net", "none")
 
         netdev_config = "user,id=net0"
 
         if forward_ports:
-            self._logger.debug(f"Configuring port forwarding: {forward_ports}")
-            for port in forward_ports:
-                netdev_config += f",hostfwd=tcp::{port}-:{port}"
+            netdev_config += "".join(
+                f",hostfwd=tcp::{port}-:{port}" for port in forward_ports
+            )
 
-        self._args.extend(["-netdev", netdev_config])
+        args = [_OPT_NETDEV, netdev_config]
 
         if use_virtio:
             # Booting to UEFI, use virtio-net-pci
-            self._args.extend(["-device", "virtio-net-pci,netdev=net0"])
+            args += (_OPT_DEVICE, "virtio-net-pci,netdev=net0")
         else:
             # Booting to Windows, use a PCI nic
-            self._args.extend(["-device", "e1000,netdev=net0"])
+            args += (_OPT_DEVICE, "e1000,netdev=net0")
 
-        return self
+        return args
 
     def with_smbios(self, smbios_values=None):
         """Configure SMBIOS information (idempotent - only adds once)
@@ -395,70 +600,24 @@ class QemuCommandBuilder:
                 - 'smbios3_sku': SKU number (default: 'Q35' for Q35, 'ARM Virt' for ARM Virt)
                 - 'smbios3_version': Chassis version (default: '')
         """
-        if self._smbios_added:
-            self._logger.debug("SMBIOS already configured, skipping")
-            return self
+        defaults = self._tpl.smbios_defaults
+        values = {**defaults, **smbios_values} if smbios_values else defaults
+        self._add_once(self._F_SMBIOS, "smbios", QemuCommandBuilder._render_smbios, values)
+        return self
 
-        self._smbios_added = True
-        if self._architecture == QemuArchitecture.Q35:
-            defaults = {
-                # Type 0 (BIOS Information)
-                "smbios0_vendor": "Patina",
-                "smbios0_version": "patina-q35-patched",
-                "smbios0_date": datetime.datetime.now().strftime("%m/%d/%Y"),
-                # Type 1 (System Information)
-                "smbios1_manufacturer": "OpenDevicePartnership",
-                "smbios1_product": "QEMU Q35",
-                "smbios1_family": "QEMU",
-                "smbios1_version": "10.0.0",
-                "smbios1_serial": "42-42-42-42",
-                "smbios1_uuid": "99fb60e2-181c-413a-a3cf-0a5fea8d87b0",
-                # Type 3 (Chassis Information)
-                "smbios3_manufacturer": "OpenDevicePartnership",
-                "smbios3_serial": "40-41-42-43",
-                "smbios3_asset": "Q35",
-                "smbios3_sku": "Q35",
-                "smbios3_version": "",
-            }
-        else:
-            defaults = {
-                # Type 0 (BIOS Information)
-                "smbios0_vendor": "Patina",
-                "smbios0_version": "patina-armvirt-patched",
-                "smbios0_date": datetime.datetime.now().strftime("%m/%d/%Y"),
-                # Type 1 (System Information)
-                "smbios1_manufacturer": "OpenDevicePartnership",
-                "smbios1_product": "QEMU ARM Virt",
-                "smbios1_family": "QEMU",
-                "smbios1_version": "10.0.0",
-                "smbios1_serial": "42-42-42-42",
-                "smbios1_uuid": "99fb60e2-181c-413a-a3cf-0a5fea8d87b0",
-                # Type 3 (Chassis Information)
-                "smbios3_manufacturer": "OpenDevicePartnership",
-                "smbios3_serial": "42-42-42-42",
-                "smbios3_asset": "ARM Virt",
-                "smbios3_sku": "ARM Virt",
-                "smbios3_version": "",
-            }
-
-        if smbios_values:
-            defaults.update(smbios_values)
-
-        values = defaults
-
-        self._args.extend(
-            [
-                "-smbios",
-                f"type=0,vendor=\"{values['smbios0_vendor']}\",version=\"{values['smbios0_version']}\",date=\"{values['smbios0_date']}\",uefi=on",
-                "-smbios",
-                f"type=1,manufacturer=\"{values['smbios1_manufacturer']}\",product=\"{values['smbios1_product']}\",family=\"{values['smbios1_family']}\",version=\"{values['smbios1_version']}\",serial=\"{values['smbios1_serial']}\",uuid={values['smbios1_uuid']}",
-                "-smbios",
-                f"type=3,manufacturer=\"{values['smbios3_manufacturer']}\",serial=\"{values['smbios3_serial']}\",asset=\"{values['smbios3_asset']}\",sku=\"{values['smbios3_sku']}\",version=\"{values['smbios3_version']}\"",
-            ]
+    def _render_smbios(self, values):
+        if values["smbios0_date"] is None:
+            values = {**values, "smbios0_date": _smbios_date(datetime.date.today().toordinal())}
+
+        return (
+            _OPT_SMBIOS,
+            _SMBIOS0_TEMPLATE.format_map(values),
+            _OPT_SMBIOS,
+            _SMBIOS1_TEMPLATE.format_map(values),
+            _OPT_SMBIOS,
+            _SMBIOS3_TEMPLATE.format_map(values),
         )
 
-        return self
-
     def with_tpm(self, sw_tpm_enable, tpm_dir=None):
         """Configure TPM device"""
         # SWTPM needs to be enabled
@@ -471,28 +630,20 @@ class QemuCommandBuilder:
             return self
 
         # Do not configure the TPM more than once
-        if self._tpm_added:
-            self._logger.debug("TPM already configured, skipping")
-            return self
+        self._add_once(self._F_TPM, "tpm", QemuCommandBuilder._render_tpm, tpm_dir)
+        return self
 
+    def _render_tpm(self, tpm_dir):
         tpm_sock = os.path.join(tpm_dir, "swtpm-sock")
-        self._tpm_added = True
-        self._args.extend(
-            [
-                "-chardev",
-                f"socket,id=chrtpm,path={tpm_sock}",
-                "-tpmdev",
-                "emulator,id=tpm0,chardev=chrtpm",
-            ]
+        return (
+            "-chardev",
+            f"socket,id=chrtpm,path={tpm_sock}",
+            "-tpmdev",
+            "emulator,id=tpm0,chardev=chrtpm",
+            _OPT_DEVICE,
+            self._tpl.tpm_device,
         )
 
-        if self._architecture == QemuArchitecture.Q35:
-            self._args.extend(["-device", "tpm-tis,tpmdev=tpm0"])
-        elif self._architecture == QemuArchitecture.ARM_VIRT:
-            self._args.extend(["-device", "tpm-tis-device,tpmdev=tpm0"])
-
-        return self
-
     def with_display(self, enabled=True):
         """Configure display output
 
@@ -501,23 +652,15 @@ class QemuCommandBuilder:
                 - True: Configures display (Bochs for Q35 and ARM Virt)
                 - False: Disables display (headless mode, -display none)
         """
-        if self._display_added:
-            self._logger.debug("Display already configured, skipping")
-            return self
+        if self._add_once(self._F_DISPLAY, "display", QemuCommandBuilder._render_display, enabled):
+            if not enabled:
+                self._logger.debug("Display disabled (headless mode)")
+        return self
 
-        self._display_added = True
+    def _render_display(self, enabled):
         if not enabled:
-            self._logger.debug("Display disabled (headless mode)")
-            self._args.extend(["-display", "none"])
-        elif self._architecture == QemuArchitecture.Q35:
-            self._args.extend(["-device", "bochs-display,addr=0x03", "-vga", "none"])
-        elif self._architecture == QemuArchitecture.ARM_VIRT:
-            # Pin to a fixed PCI slot so the firmware's preferred-video
-            # device path stays stable regardless of how many other PCI
-            # devices precede it on the command line.
-            self._args.extend(["-device", "bochs-display,addr=0x1f"])
-
-        return self
+            return ("-display", "none")
+        return self._tpl.display_args
 
     def with_gdb_server(self, port, ip="127.0.0.1"):
         """Enable GDB server
@@ -526,16 +669,15 @@ class QemuCommandBuilder:
             port: Port number for GDB server
             ip: IP address to bind to (default: 127.0.0.1)
         """
-        if self._gdb_server_added:
-            self._logger.debug("GDB server already configured, skipping")
-            return self
-
-        if port:
-            self._gdb_server_added = True
-            self._logger.info(f"Enabling GDB server on tcp:{ip}:{port}")
-            self._args.extend(["-gdb", f"tcp:{ip}:{port}"])
+        if port and self._add_once(
+            self._F_GDB_SERVER, "gdb_server", QemuCommandBuilder._render_gdb_server, port, ip
+        ):
+            self._logger.info("Enabling GDB server on tcp:%s:%s", ip, port)
         return self
 
+    def _render_gdb_server(self, port, ip):
+        return ("-gdb", f"tcp:{ip}:{port}")
+
     def with_serial_port(self, port=None, log_files=None, ip="127.0.0.1"):
         """Configure serial port for console output
 
@@ -544,19 +686,24 @@ class QemuCommandBuilder:
             log_files: List of log files to write serial output to (only used when port is None)
             ip: IP address to bind to (default: 127.0.0.1)
         """
-        if self._serial_port_added:
-            self._logger.debug("Serial port already configured, skipping")
-            return self
+        if not port and log_files:
+            log_files = tuple(log_files)
+        self._add_once(
+            self._F_SERIAL_PORT, "serial_port", QemuCommandBuilder._render_serial_port,
+            port, log_files, ip,
+        )
+        return self
 
-        self._serial_port_added = True
+    def _render_serial_port(self, port, log_files, ip):
+        args = []
         if port:
-            self._args.extend(["-serial", f"tcp:{ip}:{port},server,nowait"])
+            args += ("-serial", f"tcp:{ip}:{port},server,nowait")
         else:
             if log_files:
-                self._args.extend(["-serial", "stdio"])
+                args += ("-serial", "stdio")
                 for log_file in log_files:
-                    self._args.extend(["-serial", f"file:{log_file}"])
-        return self
+                    args += ("-serial", f"file:{log_file}")
+        return args
 
     def with_virtio_serial(self, port=None, ip="127.0.0.1"):
         """Configure a virtio serial port for console output
@@ -566,16 +713,20 @@ class QemuCommandBuilder:
             ip: IP address to bind to (default: 127.0.0.1)
         """
 
-        self._args.extend(["-global", "virtio-mmio.force-legacy=false"])
+        self._add_section(None, QemuCommandBuilder._render_virtio_serial, port, ip)
+        return self
+
+    def _render_virtio_serial(self, port, ip):
+        args = [_OPT_GLOBAL, "virtio-mmio.force-legacy=false"]
         if port:
-            self._args.extend(["-chardev", f"socket,id=vcon0,host={ip},port={port},server=on,wait=off"])
+            args += ("-chardev", f"socket,id=vcon0,host={ip},port={port},server=on,wait=off")
         else:
-            self._args.extend(["-chardev", "null,id=vcon0"])
+            args += ("-chardev", "null,id=vcon0")
 
-        self._args.extend(["-device", "virtio-serial-device,id=vser0,max_ports=1"])
-        self._args.extend(["-device", "virtconsole,chardev=vcon0,bus=vser0.0,nr=0"])
+        args += (_OPT_DEVICE, "virtio-serial-device,id=vser0,max_ports=1")
+        args += (_OPT_DEVICE, "virtconsole,chardev=vcon0,bus=vser0.0,nr=0")
 
-        return self
+        return args
 
     def with_monitor_port(self, port, ip="127.0.0.1"):
         """Configure monitor port
@@ -584,15 +735,15 @@ class QemuCommandBuilder:
             port: Port number for monitor connection
             ip: IP address to bind to (default: 127.0.0.1)
         """
-        if self._monitor_port_added:
-            self._logger.debug("Monitor port already configured, skipping")
-            return self
-
         if port:
-            self._monitor_port_added = True
-            self._args.extend(["-monitor", f"tcp:{ip}:{port},server,nowait"])
+            self._add_once(
+                self._F_MONITOR_PORT, "monitor_port", QemuCommandBuilder._render_monitor_port, port, ip
+            )
         return self
 
+    def _render_monitor_port(self, port, ip):
+        return ("-monitor", f"tcp:{ip}:{port},server,nowait")
+
     def with_custom(self, *args):
         """Add custom QEMU arguments (can be called multiple times)
 
@@ -617,17 +768,38 @@ class QemuCommandBuilder:
             .with_custom("-device", "nvme,drive=nvme0,serial=deadbeef")
         """
         if args:
-            self._args.extend(args)
+            self._add_section(None, QemuCommandBuilder._render_custom, *args)
         return self
 
+    def _render_custom(self, *args):
+        return args
+
     def get_executable(self):
         """Get the QEMU executable path"""
         return self._executable
 
     def build(self):
-        """Build and return the executable and arguments as a tuple"""
-        return (self._executable, self._args)
+        """Build and return the executable and arguments as a tuple
+
+        The arguments are returned as a tuple. The result is cached, so
+        repeated calls without adding sections return the same object.
+        """
+        if self._built_cache is None:
+            args = []
+            for render, inputs in self._sections.values():
+                args += render(self, *inputs)
+            self._built_cache = (self._executable, tuple(args))
+        return self._built_cache
+
+    def as_list(self):
+        """Return the executable followed by the arguments as a new list
+
+        Use this instead of `build()` when the caller needs a mutable command.
+        """
+        (executable, args) = self.build()
+        return [executable, *args]
 
     def __str__(self):
         """Return the full command line as a string"""
-        return f"{self._executable} {' '.join(self._args)}"
+        (executable, args) = self.build()
+        return f"{executable} {' '.join(args)}"
@@ -0,0 +1,578 @@
+##
+# Shared implementation of the QemuRunner plugins for Q35 and ARM Virt.
+# Each platform's QemuRunner plugin describes its differences in a
+# QemuRunnerProfile and hands it to run_common.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+"""Shared QemuRunner implementation for Q35 and ARM Virt"""
+
+import asyncio
+import io
+import logging
+import mmap
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import types
+from collections.abc import Callable
+from typing import NamedTuple
+from dataclasses import dataclass
+
+from edk2toollib import utility_functions
+
+from QemuCommandBuilder import QemuCommandBuilder
+from QemuCommandBuilder import QemuArchitecture
+
+_IS_WINDOWS = os.name == "nt"
+
+if _IS_WINDOWS:
+    try:
+        import win32console
+    except ImportError:
+        win32console = None
+else:
+    win32console = None
+
+# expected version string will be "QEMU emulator version maj.min.rev"
+_VER_RE = re.compile(r"version\s*([\d.]+)")
+
+# QueryQemuVersion results keyed on (absolute path, mtime) of the executable
+_VERSION_CACHE: dict[tuple[str, float], tuple[int, ...]] = {}
+_VERSION_CACHE_LOCK = threading.Lock()
+
+# env values that GetBool/GetBuildBool treat as True (compared after strip + lower)
+_TRUE_VALS = frozenset(("true", "yes", "y", "1", "on", "t"))
+
+# (attribute, key, kind, default) for every env value the Runner reads
+_ENV_SPEC = (
+    ("alt_boot_enable", "ALT_BOOT_ENABLE", "bool", False),
+    ("boot_to_front_page", "BOOT_TO_FRONT_PAGE", "bool", False),
+    ("cpu_model", "CPU_MODEL", "str", None),
+    ("enable_network", "ENABLE_NETWORK", "bool", False),
+    ("gdb_server_port", "GDB_SERVER", "str", None),
+    ("headless", "QEMU_HEADLESS", "bool", False),
+    ("install_files", "INSTALL_FILES", "str", None),
+    ("monitor_port", "MONITOR_PORT", "str", None),
+    ("output_path", "BUILD_OUTPUT_BASE", "str", None),
+    ("path_to_os", "PATH_TO_OS", "str", None),
+    ("os_boot_device", "OS_BOOT_DEVICE", "str", "SSD"),
+    ("path_to_seed", "PATH_TO_SEED", "str", None),
+    ("qemu_accelerator", "QEMU_ACCEL", "str", None),
+    ("qemu_executable_path", "QEMU_PATH", "str", None),
+    ("qemu_ext_dep_dir", "QEMU_DIR", "str", None),
+    ("repo_version", "VERSION", "str", "Unknown"),
+    ("serial_port", "SERIAL_PORT", "str", None),
+    ("sw_tpm_enable", "SWTPM_ENABLE", "bool", True),
+    ("virtual_drive", "VIRTUAL_DRIVE_PATH", "str", None),
+)
+
+# how long to wait for swtpm to create its control socket, and how often to check
+_SWTPM_SOCK_TIMEOUT = 30
+_SWTPM_SOCK_POLL_INTERVAL = 0.1
+
+# longest QEMU output line RunQemuAsync reads at once (asyncio's default is 64 KiB),
+# longer lines are logged in pieces of about this size
+_ASYNC_LINE_LIMIT = 1024 * 1024
+
+# QEMU embeds its "--version" banner as a string literal in the binary
+_BIN_VER_RE = re.compile(rb"QEMU emulator version ([\d.]+)")
+
+
+def _to_bool(val, default: bool) -> bool:
+    """Interprets an env value as a bool, returning default when it is unset."""
+    if val is None:
+        return default
+    if isinstance(val, bool):
+        return val
+    return str(val).strip().lower() in _TRUE_VALS
+
+
+def _parse_version(ver_str: str) -> tuple[int, ...]:
+    """Converts "maj.min.rev" into a tuple of ints so versions compare numerically."""
+    return tuple(int(part) for part in ver_str.split(".") if part)
+
+
+def _scan_qemu_version(path: str) -> tuple[int, ...] | None:
+    """Read the version out of the QEMU binary without executing it.
+
+    Returns None if the file cannot be read or the banner is not found.
+    """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            match = _BIN_VER_RE.search(mm)
+            # the match references the mapping, so copy the version out before it is closed
+            ver = match.group(1) if match is not None else None
+    except (OSError, ValueError):
+        return None
+    if ver is None:
+        return None
+    return _parse_version(ver.decode())
+
+
+def _find_executable(path: str) -> str | None:
+    """Resolves a QEMU executable name or path, like shutil.which.
+
+    shutil.which does not try PATHEXT for paths with a directory part before
+    Python 3.12, so the extdep's "<QEMU_DIR>/qemu-system-*" also tries ".exe".
+    """
+    found = shutil.which(path)
+    if found is None and _IS_WINDOWS:
+        found = shutil.which(path + ".exe")
+    return found
+
+
+def _stdin_is_tty() -> bool:
+    """Whether stdin is an interactive terminal (False in CI with redirected input)."""
+    return sys.stdin is not None and sys.stdin.isatty()
+
+
+def _save_console_mode():
+    """Returns (std_handle, mode) of the console input, or (None, None) if there is none to restore."""
+    if win32console is None or not _stdin_is_tty():
+        return (None, None)
+    std_handle = win32console.GetStdHandle(win32console.STD_INPUT_HANDLE)
+    try:
+        return (std_handle, std_handle.GetConsoleMode())
+    except Exception:
+        return (None, None)
+
+
+class QemuQuirks(NamedTuple):
+    """Version specific workarounds, decided once per run"""
+
+    needs_console_save: bool  # QEMU v8+ on Windows leaves the console mode changed
+    segfault_on_exit: bool  # QEMU v4 segfaults when shutting down
+
+    @classmethod
+    def for_version(cls, version: tuple[int, ...] | None) -> "QemuQuirks":
+        major = version[0] if version else 0
+        return cls(needs_console_save=(_IS_WINDOWS and major >= 8), segfault_on_exit=(major == 4))
+
+
+class _RunSetup(NamedTuple):
+    """What _setup_run started or decided, for the QEMU launch and _finish_run"""
+
+    quirks: QemuQuirks
+    executable: str
+    args: list
+    swtpm_proc: subprocess.Popen | None
+    std_handle: object
+    console_mode: object
+
+
+# Platform hook: receives the partly built command and the Runner config, returns the command
+BuilderHook = Callable[[QemuCommandBuilder, types.SimpleNamespace], QemuCommandBuilder]
+
+
+@dataclass(frozen=True, slots=True)
+class QemuRunnerProfile:
+    """Platform specific pieces of a QemuRunner plugin
+
+    The hooks are called at fixed points of the shared command so that the
+    argument order (and with it the PCI slot assignment) matches the platform.
+    """
+
+    architecture: QemuArchitecture
+    default_executable: str  # used when neither QEMU_PATH nor QEMU_DIR is set
+    code_fd: str  # firmware file names under <BUILD_OUTPUT_BASE>/FV
+    vars_fd: str
+    core_count: int
+    swtpm_log_level: int
+    benign_exit_codes: frozenset  # QEMU exit codes that are reported as success
+    add_devices: BuilderHook  # after the USB controller and mouse
+    add_platform: BuilderHook  # after the display, before the TPM
+    add_serial: BuilderHook  # after the GDB server, before the monitor port
+
+
+class QemuRunnerCore:
+    """Helpers shared by the QemuRunner plugins"""
+
+    @staticmethod
+    # raw helper function to extract version number from QEMU
+    def QueryQemuVersion(exec):
+        if exec is None:
+            return None
+
+        # only cache when the executable can be stat'ed, so a replaced binary is re-queried
+        path = shutil.which(exec) or exec
+        try:
+            key = (os.path.abspath(path), os.path.getmtime(path))
+        except OSError:
+            key = None
+
+        if key is not None:
+            with _VERSION_CACHE_LOCK:
+                cached = _VERSION_CACHE.get(key)
+            if cached is not None:
+                return cached
+
+        ver = _scan_qemu_version(path)
+        if ver is None:
+            ver = QemuRunnerCore._run_qemu_version(exec)
+            if ver is None:
+                return None
+
+        if key is not None:
+            with _VERSION_CACHE_LOCK:
+                _VERSION_CACHE[key] = ver
+        return ver
+
+    @staticmethod
+    # fallback for QueryQemuVersion: run "--version" and parse its output
+    def _run_qemu_version(exec):
+        result = io.StringIO()
+        ret = utility_functions.RunCmd(exec, "--version", outstream=result)
+        if ret != 0:
+            logging.error(result.getvalue())
+            logging.error(ret)
+            return None
+
+        match = _VER_RE.search(result.getvalue())
+        if match is None:
+            logging.error("Unable to parse the QEMU version from --version output.")
+            return None
+        ver_str = match.group(1)
+
+        return _parse_version(ver_str)
+
+    @staticmethod
+    def GetBuildBool(env, key: str, default: bool = False) -> bool:
+        return _to_bool(env.GetBuildValue(key), default)
+
+    @staticmethod
+    def GetBuildStr(env, key: str, default: str | None = None) -> str | None:
+        return env.GetBuildValue(key) or default
+
+    @staticmethod
+    def GetBool(env, key: str, default: bool = False) -> bool:
+        return _to_bool(env.GetValue(key), default)
+
+    @staticmethod
+    def GetStr(env, key: str, default: str | None = None) -> str | None:
+        return env.GetValue(key) or default
+
+    @staticmethod
+    def _read_env(env, spec) -> types.SimpleNamespace:
+        """Reads every (attribute, key, kind, default) entry of spec into one namespace."""
+        getters = {
+            "bool": QemuRunnerCore.GetBool,
+            "str": QemuRunnerCore.GetStr,
+            "build_bool": QemuRunnerCore.GetBuildBool,
+            "build_str": QemuRunnerCore.GetBuildStr,
+        }
+        return types.SimpleNamespace(**{attr: getters[kind](env, key, default) for attr, key, kind, default in spec})
+
+    @staticmethod
+    def StartSwTpm(tpm_dir, tpm_sock, log_level: int = 20):
+        """Starts the swtpm emulator and returns its Popen handle.
+
+        swtpm is a long-lived daemon, so it is launched directly with Popen
+        (rather than a blocking helper run in a thread) to keep a handle for
+        explicit teardown.
+        """
+        cmd = [
+            "swtpm", "socket",
+            "--tpmstate", f"dir={tpm_dir}",
+            "--ctrl", f"type=unixio,path={tpm_sock}",
+            "--tpm2",
+            "--log", f"level={log_level}",
+        ]
+        try:
+            return subprocess.Popen(cmd)
+        except FileNotFoundError as error:
+            raise FileNotFoundError(
+                "swtpm executable not found on PATH. Install it (e.g. "
+                "'sudo apt install swtpm' on Debian/Ubuntu, 'sudo dnf install "
+                "swtpm' on Fedora) or disable SWTPM by setting SWTPM_ENABLE=FALSE."
+            ) from error
+
+    @staticmethod
+    def StopSwTpm(swtpm_proc):
+        """Terminates the swtpm subprocess if it is still running."""
+        if swtpm_proc is None or swtpm_proc.poll() is not None:
+            return
+        swtpm_proc.terminate()
+        try:
+            swtpm_proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            logging.warning("swtpm did not exit after terminate. Killing it.")
+            swtpm_proc.kill()
+
+    @staticmethod
+    def RunQemu(executable, args) -> int:
+        """Runs QEMU from an argument list and logs its output line by line.
+
+        Unlike RunCmd, the arguments are not joined into one string and re-split
+        by a shell, so values containing spaces or quotes reach QEMU unchanged.
+        """
+        with subprocess.Popen(
+            [executable, *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            encoding=sys.stdout.encoding or "utf-8",
+            errors="ignore",
+        ) as proc:
+            for line in proc.stdout:
+                logging.info(line.rstrip())
+            ret = proc.wait()
+        if ret < 0:
+            # killed by a signal, report it the way the shell used by RunCmd did (e.g. 0x8B for SIGSEGV)
+            ret = 128 - ret
+        logging.info(f"Return Code: {ret:#x}")
+        return ret
+
+    @staticmethod
+    async def RunQemuAsync(executable, args) -> int:
+        """Same as RunQemu, but awaits QEMU with asyncio instead of blocking."""
+        encoding = sys.stdout.encoding or "utf-8"
+        proc = await asyncio.create_subprocess_exec(
+            executable,
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=_ASYNC_LINE_LIMIT,
+        )
+        try:
+            while True:
+                try:
+                    line = await proc.stdout.readuntil(b"\n")
+                except asyncio.IncompleteReadError as e:
+                    # end of output, log whatever followed the last newline
+                    if e.partial:
+                        logging.info(e.partial.decode(encoding, errors="ignore").rstrip())
+                    break
+                except asyncio.LimitOverrunError as e:
+                    # an over-long line must not end the run, log what is buffered so far
+                    line = await proc.stdout.readexactly(e.consumed)
+                logging.info(line.decode(encoding, errors="ignore").rstrip())
+            ret = await proc.wait()
+        except BaseException:
+            # do not leave QEMU running when the run is cancelled or fails
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+            await proc.wait()
+            raise
+        if ret < 0:
+            # killed by a signal, report it the way the shell used by RunCmd did (e.g. 0x8B for SIGSEGV)
+            ret = 128 - ret
+        logging.info(f"Return Code: {ret:#x}")
+        return ret
+
+
+def _prepare_run(env, profile: QemuRunnerProfile):
+    """Reads the Runner config from env and builds the QEMU command for profile
+
+    Returns (cfg, quirks, executable, args), or None if a firmware file or the
+    QEMU executable is missing.
+    """
+
+    cfg = QemuRunnerCore._read_env(env, _ENV_SPEC)
+
+    fv_dir = os.path.join(cfg.output_path, "FV")
+    code_fd = os.path.join(fv_dir, profile.code_fd)
+    var_store = os.path.join(fv_dir, profile.vars_fd)
+
+    # SWTPM is only available on Linux builds, exclude Windows
+    if _IS_WINDOWS:
+        logging.warning("SWTPM is not available on Windows builds.")
+        cfg.sw_tpm_enable = False
+
+    # Use a provided QEMU path. Otherwise use what is provided through the extdep
+    if not cfg.qemu_executable_path:
+        if cfg.qemu_ext_dep_dir:
+            cfg.qemu_executable_path = os.path.join(cfg.qemu_ext_dep_dir, profile.default_executable)
+        else:
+            cfg.qemu_executable_path = profile.default_executable
+
+    # Fail before probing QEMU or building the command line if the run cannot start
+    for fd in (code_fd, var_store):
+        if not os.path.isfile(fd):
+            logging.error(f"Firmware file not found: {fd}")
+            return None
+    if _find_executable(cfg.qemu_executable_path) is None:
+        logging.error(f"QEMU executable not found: {cfg.qemu_executable_path}")
+        return None
+
+    # If we are using the QEMU external dependency, we need to tell it
+    # where to look for roms
+    rom_path = None
+    if cfg.qemu_ext_dep_dir:
+        rom_path = os.path.join(cfg.qemu_ext_dep_dir, "share")
+
+    cfg.boot_selection = ""
+    if cfg.boot_to_front_page:
+        cfg.boot_selection += "Vol+"
+
+    if cfg.alt_boot_enable:
+        cfg.boot_selection += "Vol-"
+
+    cfg.qemu_version = QemuRunnerCore.QueryQemuVersion(cfg.qemu_executable_path)
+    quirks = QemuQuirks.for_version(cfg.qemu_version)
+    qemu_cmd_builder = profile.add_devices(
+        QemuCommandBuilder(cfg.qemu_executable_path, profile.architecture)
+        .with_cpu(cfg.cpu_model, profile.core_count)
+        .with_machine(cfg.qemu_accelerator)
+        .with_memory(8192 if cfg.path_to_os else 2048)
+        .with_firmware(code_fd, var_store)
+        .with_rom_path(rom_path)
+        .with_usb_controller()
+        .with_usb_mouse(),
+        cfg,
+    )
+    qemu_cmd_builder = profile.add_platform(
+        qemu_cmd_builder
+        .with_storage(cfg.path_to_os, cfg.os_boot_device)
+        .with_virtual_drive(None if cfg.path_to_os else cfg.virtual_drive)
+        .with_display(not cfg.headless),
+        cfg,
+    )
+    qemu_cmd_builder = profile.add_serial(
+        qemu_cmd_builder
+        .with_tpm(cfg.sw_tpm_enable, tpm_dir=cfg.output_path)
+        .with_gdb_server(cfg.gdb_server_port),
+        cfg,
+    ).with_monitor_port(cfg.monitor_port)
+
+    if cfg.path_to_seed:
+        qemu_cmd_builder = qemu_cmd_builder.with_custom("-drive", f"file={cfg.path_to_seed},format=raw,if=virtio")
+
+    (executable, args) = qemu_cmd_builder.build()
+    logging.info(f"Running QEMU: {executable} {args}")
+
+    return (cfg, quirks, executable, args)
+
+
+def _start_swtpm(cfg, profile: QemuRunnerProfile):
+    """Starts swtpm if enabled, returning (swtpm_proc, tpm_sock) or (None, None)"""
+    if not cfg.sw_tpm_enable:
+        return (None, None)
+
+    # same directory and socket name the builder passed to QEMU's -chardev
+    tpm_dir = cfg.output_path
+    tpm_sock = os.path.join(tpm_dir, "swtpm-sock")
+    logging.info("Starting swtpm emulator.")
+    return (QemuRunnerCore.StartSwTpm(tpm_dir, tpm_sock, profile.swtpm_log_level), tpm_sock)
+
+
+def _swtpm_ready(swtpm_proc, tpm_sock, poll_start) -> bool | None:
+    """Checks once whether swtpm has created its control socket.
+
+    QEMU may fail to connect if it is launched before the socket exists.
+    Returns True once it does, None while still waiting, and False if swtpm
+    exited or timed out (swtpm is stopped in that case).
+    """
+    if os.path.exists(tpm_sock):
+        return True
+    if swtpm_proc.poll() is not None:
+        logging.critical("swtpm exited before creating its socket.")
+        return False
+    if time.monotonic() - poll_start > _SWTPM_SOCK_TIMEOUT:
+        logging.critical(f"Timed out waiting for swtpm socket at {tpm_sock}.")
+        QemuRunnerCore.StopSwTpm(swtpm_proc)
+        return False
+    return None
+
+
+def _finish_run(ret, profile: QemuRunnerProfile, setup: _RunSetup) -> int:
+    """Maps known benign QEMU exit codes to success and restores the console"""
+
+    ## TODO: restore the customized RunCmd once unit tests with asserts are figured out
+    if ret in profile.benign_exit_codes:
+        ret = 0
+
+    ## TODO: remove this once we upgrade to newer QEMU
+    if ret == 0x8B and setup.quirks.segfault_on_exit:
+        # QEMU v4 will return segmentation fault when shutting down.
+        # Tested same FDs on QEMU 6 and 7, not observing the same.
+        ret = 0
+
+    if setup.std_handle is not None:
+        # Restore the console mode for Windows on QEMU v8+.
+        setup.std_handle.SetConsoleMode(setup.console_mode)
+    elif not _IS_WINDOWS and _stdin_is_tty():
+        # Linux version of QEMU will mess with the print if its run failed, let's just restore it anyway.
+        # Without a terminal on stdin there is nothing to restore.
+        utility_functions.RunCmd("stty", "sane", capture=False)
+
+    return ret
+
+
+def _setup_run(env, profile: QemuRunnerProfile) -> _RunSetup | int:
+    """Does everything before the QEMU launch that run_common and run_common_async share
+
+    Builds the command, starts swtpm and waits for its socket, and saves the
+    console mode. Returns the exit code to report instead if the run cannot start.
+    """
+    prepared = _prepare_run(env, profile)
+    if prepared is None:
+        return 1
+    (cfg, quirks, executable, args) = prepared
+
+    (swtpm_proc, tpm_sock) = _start_swtpm(cfg, profile)
+    if swtpm_proc is not None:
+        poll_start = time.monotonic()
+        while (ready := _swtpm_ready(swtpm_proc, tpm_sock, poll_start)) is None:
+            time.sleep(_SWTPM_SOCK_POLL_INTERVAL)
+        if not ready:
+            return -1
+
+    ## TODO: Save the console mode. The original issue comes from: https://gitlab.com/qemu-project/qemu/-/issues/1674
+    std_handle, console_mode = (None, None)
+    if quirks.needs_console_save:
+        std_handle, console_mode = _save_console_mode()
+
+    return _RunSetup(quirks, executable, args, swtpm_proc, std_handle, console_mode)
+
+
+def run_common(env, profile: QemuRunnerProfile) -> int:
+    """Runs QEMU for the platform described by profile"""
+    setup = _setup_run(env, profile)
+    if isinstance(setup, int):
+        return setup
+
+    # Run QEMU
+    try:
+        ret = QemuRunnerCore.RunQemu(setup.executable, setup.args)
+    finally:
+        QemuRunnerCore.StopSwTpm(setup.swtpm_proc)
+
+    return _finish_run(ret, profile, setup)
+
+
+async def run_common_async(env, profile: QemuRunnerProfile) -> int:
+    """Runs QEMU for the platform described by profile without blocking the event loop
+
+    Independent runs (e.g. Q35 and ARM Virt, or several configurations) can be
+    awaited together with asyncio.gather(). The blocking steps before and after
+    QEMU (file checks, version scan, waiting for swtpm, stty) run in a worker
+    thread. Cancelling the run kills QEMU and stops swtpm.
+    """
+    pending = asyncio.ensure_future(asyncio.to_thread(_setup_run, env, profile))
+    try:
+        setup = await asyncio.shield(pending)
+    except asyncio.CancelledError:
+        # the setup thread cannot be interrupted, so stop what it started once it is done
+        setup = await pending
+        if not isinstance(setup, int):
+            await asyncio.to_thread(QemuRunnerCore.StopSwTpm, setup.swtpm_proc)
+        raise
+    if isinstance(setup, int):
+        return setup
+
+    # Run QEMU
+    try:
+        ret = await QemuRunnerCore.RunQemuAsync(setup.executable, setup.args)
+    finally:
+        await asyncio.to_thread(QemuRunnerCore.StopSwTpm, setup.swtpm_proc)
+
+    return await asyncio.to_thread(_finish_run, ret, profile, setup)
@@ -8,242 +8,57 @@
 
 import logging
 import os
-import re
-import io
-import shutil
-import subprocess
-import time
 from edk2toolext.environment.plugintypes import uefi_helper_plugin
-from edk2toollib import utility_functions
 
-from QemuCommandBuilder import QemuCommandBuilder
 from QemuCommandBuilder import QemuArchitecture
+from QemuRunnerCore import QemuRunnerCore, QemuRunnerProfile, run_common, run_common_async
 
 
-# """QEMU Command Builder for Q35 and ArmVirt architectures"""
+def _add_devices(builder, cfg):
+    return builder.with_usb_storage(cfg.install_files, "install_disk")
 
 
-class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
+def _add_platform(builder, cfg):
+    forward_ports = None
+    use_virtio = cfg.boot_to_front_page or cfg.alt_boot_enable
+    return builder.with_network(forward_ports, use_virtio)
 
-    def __init__(self):
-        self.logger = logging.getLogger(__name__)
-
-    def RegisterHelpers(self, obj):
-        fp = os.path.abspath(__file__)
-        obj.Register("QemuRun", QemuRunner.Runner, fp)
-        return 0
-
-    @staticmethod
-    # raw helper function to extract version number from QEMU
-    def QueryQemuVersion(exec):
-        if exec is None:
-            return None
 
-        result = io.StringIO()
-        ret = utility_functions.RunCmd(exec, "--version", outstream=result)
-        if ret != 0:
-            logging.error(result.getvalue())
-            logging.error(ret)
-            return None
+def _add_serial(builder, cfg):
+    return builder.with_serial_port(cfg.serial_port)
 
-        # expected version string will be "QEMU emulator version maj.min.rev"
-        res = result.getvalue()
-        ver_str = re.search(r"version\s*([\d.]+)", res).group(1)
-
-        return ver_str.split(".")
-
-    @staticmethod
-    def GetBuildBool(env, key: str, default: bool = False) -> bool:
-        val = env.GetBuildValue(key)
-        if val is None:
-            return default
-        return val.strip().lower() in ("true", "yes", "y", "1")
 
-    @staticmethod
-    def GetBuildStr(env, key: str, default: str | None = None) -> str | None:
-        return env.GetBuildValue(key) or default
+_Q35_PROFILE = QemuRunnerProfile(
+    architecture=QemuArchitecture.Q35,
+    default_executable="qemu-system-x86_64",
+    code_fd="QEMUQ35_CODE.fd",
+    vars_fd="QEMUQ35_VARS.fd",
+    core_count=4,
+    swtpm_log_level=20,
+    benign_exit_codes=frozenset((0xC0000005, 33)),
+    add_devices=_add_devices,
+    add_platform=_add_platform,
+    add_serial=_add_serial,
+)
 
-    @staticmethod
-    def GetBool(env, key: str, default: bool = False) -> bool:
-        val = env.GetValue(key)
-        if val is None:
-            return default
-        return val.strip().lower() in ("true", "yes", "y", "1")
 
-    @staticmethod
-    def GetStr(env, key: str, default: str | None = None) -> str | None:
-        return env.GetValue(key) or default
+class QemuRunner(QemuRunnerCore, uefi_helper_plugin.IUefiHelperPlugin):
 
-    @staticmethod
-    def StartSwTpm(tpm_dir, tpm_sock):
-        """Starts the swtpm emulator and returns its Popen handle.
-
-        swtpm is a long-lived daemon, so it is launched directly with Popen
-        (rather than a blocking helper run in a thread) to keep a handle for
-        explicit teardown.
-        """
-        cmd = [
-            "swtpm", "socket",
-            "--tpmstate", f"dir={tpm_dir}",
-            "--ctrl", f"type=unixio,path={tpm_sock}",
-            "--tpm2",
-            "--log", "level=20",
-        ]
-        try:
-            return subprocess.Popen(cmd)
-        except FileNotFoundError as error:
-            raise FileNotFoundError(
-                "swtpm executable not found on PATH. Install it (e.g. "
-                "'sudo apt install swtpm' on Debian/Ubuntu, 'sudo dnf install "
-                "swtpm' on Fedora) or disable SWTPM by setting SWTPM_ENABLE=FALSE."
-            ) from error
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
 
-    @staticmethod
-    def StopSwTpm(swtpm_proc):
-        """Terminates the swtpm subprocess if it is still running."""
-        if swtpm_proc is None or swtpm_proc.poll() is not None:
-            return
-        swtpm_proc.terminate()
-        try:
-            swtpm_proc.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            logging.warning("swtpm did not exit after terminate. Killing it.")
-            swtpm_proc.kill()
+    def RegisterHelpers(self, obj):
+        fp = os.path.abspath(__file__)
+        obj.Register("QemuRun", QemuRunner.Runner, fp)
+        obj.Register("QemuRunAsync", QemuRunner.RunnerAsync, fp)
+        return 0
 
     @staticmethod
     def Runner(env):
         """Runs QEMU"""
+        return run_common(env, _Q35_PROFILE)
 
-        alt_boot_enable = QemuRunner.GetBool(env, "ALT_BOOT_ENABLE", False)
-        boot_to_front_page = QemuRunner.GetBool(env, "BOOT_TO_FRONT_PAGE", False)
-        cpu_model = QemuRunner.GetStr(env, "CPU_MODEL")
-        enable_network = QemuRunner.GetBool(env, "ENABLE_NETWORK", False)
-        executable = QemuRunner.GetStr(env, "QEMU_PATH")
-        gdb_server_port = QemuRunner.GetStr(env, "GDB_SERVER")
-        headless = QemuRunner.GetBool(env, "QEMU_HEADLESS", False)
-        install_files = QemuRunner.GetStr(env, "INSTALL_FILES")
-        monitor_port = QemuRunner.GetStr(env, "MONITOR_PORT")
-        output_path = QemuRunner.GetStr(env, "BUILD_OUTPUT_BASE")
-        path_to_os = QemuRunner.GetStr(env, "PATH_TO_OS")
-        os_boot_device = QemuRunner.GetStr(env, "OS_BOOT_DEVICE", "SSD")
-        path_to_seed = QemuRunner.GetStr(env, "PATH_TO_SEED")
-        qemu_accelerator = QemuRunner.GetStr(env, "QEMU_ACCEL")
-        qemu_executable_path = QemuRunner.GetStr(env, "QEMU_PATH")
-        qemu_ext_dep_dir = QemuRunner.GetStr(env, "QEMU_DIR")
-        serial_port = QemuRunner.GetStr(env, "SERIAL_PORT")
-        sw_tpm_enable = QemuRunner.GetBool(env, "SWTPM_ENABLE", True)
-        virtual_drive = QemuRunner.GetStr(env, "VIRTUAL_DRIVE_PATH")
-
-        code_fd = os.path.join(output_path, "FV", "QEMUQ35_CODE.fd")
-        var_store = os.path.join(output_path, "FV", "QEMUQ35_VARS.fd")
-
-        # SWTPM is only available on Linux builds, exclude Windows
-        if os.name == 'nt':
-            logging.warning("SWTPM is not available on Windows builds.")
-            sw_tpm_enable = False
-
-        # Use a provided QEMU path. Otherwise use what is provided through the extdep
-        if not qemu_executable_path:
-            if qemu_ext_dep_dir:
-                qemu_executable_path = os.path.join(qemu_ext_dep_dir, "qemu-system-x86_64")
-            else:
-                qemu_executable_path = "qemu-system-x86_64"
-
-        # If we are using the QEMU external dependency, we need to tell it
-        # where to look for roms
-        rom_path = None
-        if qemu_ext_dep_dir:
-            rom_path = os.path.join(qemu_ext_dep_dir, "share")
-
-        forward_ports = None
-
-        boot_selection = ""
-        if boot_to_front_page:
-            boot_selection += "Vol+"
-
-        if alt_boot_enable:
-            boot_selection += "Vol-"
-
-        use_virtio = boot_to_front_page or alt_boot_enable
-
-        qemu_version = QemuRunner.QueryQemuVersion(qemu_executable_path)
-        qemu_cmd_builder = (
-            QemuCommandBuilder(qemu_executable_path, QemuArchitecture.Q35)
-            .with_cpu(cpu_model, 4)
-            .with_machine(qemu_accelerator)
-            .with_memory(8192 if path_to_os else 2048)
-            .with_firmware(code_fd, var_store)
-            .with_rom_path(rom_path)
-            .with_usb_controller()
-            .with_usb_mouse()
-            .with_usb_storage(install_files, "install_disk")
-            .with_storage(path_to_os, os_boot_device)
-            .with_virtual_drive(None if path_to_os else virtual_drive)
-            .with_display(not headless)
-            .with_network(forward_ports, use_virtio)
-            .with_tpm(sw_tpm_enable, tpm_dir=output_path)
-            .with_gdb_server(gdb_server_port)
-            .with_serial_port(serial_port)
-            .with_monitor_port(monitor_port)
-        )
-
-        if path_to_seed:
-            qemu_cmd_builder = qemu_cmd_builder.with_custom("-drive", f"file=\"{path_to_seed}\",format=raw,if=virtio")
-
-        ## TODO: Save the console mode. The original issue comes from: https://gitlab.com/qemu-project/qemu/-/issues/1674
-        if os.name == "nt" and qemu_version[0] >= "8":
-            import win32console
-
-            std_handle = win32console.GetStdHandle(win32console.STD_INPUT_HANDLE)
-            try:
-                console_mode = std_handle.GetConsoleMode()
-            except Exception:
-                std_handle = None
-
-        (executable, args) = qemu_cmd_builder.build()
-
-        swtpm_proc = None
-        if sw_tpm_enable:
-            tpm_dir = env.GetValue("BUILD_OUTPUT_BASE")
-            tpm_sock = os.path.join(tpm_dir, "swtpm-sock")
-            logging.info("Starting swtpm emulator.")
-            swtpm_proc = QemuRunner.StartSwTpm(tpm_dir, tpm_sock)
-
-            # Wait for swtpm to create the control socket before launching QEMU.
-            # Otherwise QEMU may try to connect before the socket exists and fail.
-            tpm_sock_timeout = 30
-            tpm_sock_poll_start = time.monotonic()
-            while not os.path.exists(tpm_sock):
-                if swtpm_proc.poll() is not None:
-                    logging.critical("swtpm exited before creating its socket.")
-                    return -1
-                if time.monotonic() - tpm_sock_poll_start > tpm_sock_timeout:
-                    logging.critical(f"Timed out waiting for swtpm socket at {tpm_sock}.")
-                    QemuRunner.StopSwTpm(swtpm_proc)
-                    return -1
-                time.sleep(0.1)
-
-        # Run QEMU
-        try:
-            ret = utility_functions.RunCmd(executable, str.join(" ", args))
-        finally:
-            QemuRunner.StopSwTpm(swtpm_proc)
-
-        ## TODO: restore the customized RunCmd once unit tests with asserts are figured out
-        if ret == 0xC0000005 or ret == 33:
-            ret = 0
-
-        ## TODO: remove this once we upgrade to newer QEMU
-        if ret == 0x8B and qemu_version[0] == "4":
-            # QEMU v4 will return segmentation fault when shutting down.
-            # Tested same FDs on QEMU 6 and 7, not observing the same.
-            ret = 0
-
-        if os.name == "nt" and qemu_version[0] >= "8" and std_handle is not None:
-            # Restore the console mode for Windows on QEMU v8+.
-            std_handle.SetConsoleMode(console_mode)
-        elif os.name != "nt":
-            # Linux version of QEMU will mess with the print if its run failed, let's just restore it anyway
-            utility_functions.RunCmd("stty", "sane", capture=False)
-
-        return ret
+    @staticmethod
+    async def RunnerAsync(env):
+        """Runs QEMU without blocking the event loop, for use with asyncio.gather()"""
+        return await run_common_async(env, _Q35_PROFILE)
@@ -10,21 +10,47 @@
 ##
 
 import argparse
+import functools
+import hashlib
 import logging
 import os
+import re
+import shlex
 import shutil
 import subprocess
 import sys
-import timeit
-from datetime import datetime
+import time
 from pathlib import Path
-from typing import Dict
-
-from Platforms.Common.Qemu.QemuCommandBuilder import QemuCommandBuilder
-from Platforms.Common.Qemu.QemuCommandBuilder import QemuArchitecture
+from typing import Dict, List, Optional, Tuple, Union
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 
+# Directories that never feed the Rust DXE Core build
+FINGERPRINT_SKIP_DIRS = {".git", "target"}
+# Environment variables that can change it: cargo, rustc, rustup and the C compilers of build scripts
+FINGERPRINT_ENV_PREFIXES = ("CARGO", "RUST", "CC", "CFLAGS", "CXX")
+
+# `path = "..."` entries of a Cargo.toml, i.e. path dependencies and workspace members
+_PATH_DEP_RE = re.compile(r'\bpath\s*=\s*"([^"]+)"')
+
+# Unpatched copies of the code FDs, reused as patch references across runs
+REF_FD_CACHE_DIR = SCRIPT_DIR / "Build" / "ref_fd_cache"
+
+# Pickled _configure_settings results from earlier runs
+SETTINGS_CACHE_DIR = SCRIPT_DIR / "Build" / "settings_cache"
+SETTINGS_CACHE_LIMIT = 16
+
+SHUTDOWN_DRIVE_DIR = SCRIPT_DIR / "Build" / "shutdown_drive"
+
+# Default QEMU executable names per platform, as (Windows, POSIX)
+_QEMU_EXECUTABLES = {
+    "Q35": ("qemu-system-x86_64", "qemu-system-x86_64"),
+    "ARM_VIRT": ("qemu-system-aarch64.exe", "qemu-system-aarch64"),
+}
+
+# Linux ioctl to share the extents of one file with another, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
 
 def _create_shutdown_drive(dest_dir: Path) -> Path:
     """Creates a directory containing a startup.nsh script that shuts down the system.
@@ -40,6 +66,152 @@ def _create_shutdown_drive(dest_dir: Path) -> Path:
     return dest_dir
 
 
+def _fast_clone(src: Path, dst: Path) -> None:
+    """Copies src to dst as a copy-on-write clone where the filesystem supports it.
+
+    Uses the FICLONE ioctl on Linux (Btrfs, XFS, ...) and clonefile() on macOS
+    (APFS). Falls back to shutil.copy on other platforms, or when cloning is not
+    possible (e.g. ext4, or src and dst on different filesystems).
+
+    Args:
+        src (Path): File to copy.
+        dst (Path): Destination file, replaced if it exists.
+    """
+    if sys.platform.startswith("linux"):
+        import fcntl
+
+        try:
+            with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            shutil.copymode(src, dst)
+            return
+        except OSError:
+            pass
+    elif sys.platform == "darwin":
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        Path(dst).unlink(missing_ok=True)  # clonefile() does not replace files
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+            return
+
+    shutil.copy(src, dst)
+
+
+def _fd_stamp(st: os.stat_result) -> str:
+    """Returns the size and modification time from a FD or EFI's stat, used to tell if it was rewritten."""
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _prepare_ref_fd(settings: Dict[str, Path]) -> None:
+    """Creates the reference FD that patch.py patches the EFI into.
+
+    The first time a code FD is patched, an unpatched copy of it is kept in the
+    ref_fd cache. As long as code_fd is still the output of the last patch, later
+    runs take the reference from that cache (hardlinked, so no bytes are copied)
+    rather than copying the whole FD again. Rebuilding the firmware rewrites
+    code_fd, which refreshes the cache on the next run.
+
+    The hardlink relies on patch.py only reading its -r reference file.
+
+    Args:
+        settings (Dict[str, Path]): A dictionary containing the following keys:
+            - 'code_fd': Path to patch output FD file.
+            - 'code_fd_stat': The stat of code_fd taken when the settings were loaded.
+            - 'ref_fd': Path to patch input (reference) FD file.
+            - 'ref_fd_cache': Path to the cached unpatched copy of code_fd.
+    """
+    code_fd, ref_fd, cache = settings["code_fd"], settings["ref_fd"], settings["ref_fd_cache"]
+    stamp = cache.with_suffix(".stamp")
+    ref_fd.unlink(missing_ok=True)
+
+    code_fd_stat = settings["code_fd_stat"]
+    if (
+        code_fd_stat is not None
+        and cache.is_file()
+        and stamp.is_file()
+        and stamp.read_text() == _fd_stamp(code_fd_stat)
+    ):
+        try:
+            os.link(cache, ref_fd)
+        except OSError:
+            _fast_clone(cache, ref_fd)
+        return
+
+    _fast_clone(code_fd, ref_fd)
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    stamp.unlink(missing_ok=True)
+    _fast_clone(code_fd, cache)
+
+
+def _stat_line(path: str) -> str:
+    """Returns the path, size and modification time of path as one fingerprint line."""
+    st = os.stat(path)
+    return f"{path}\0{st.st_size}\0{st.st_mtime_ns}\n"
+
+
+def _source_fingerprint(repos: List[Path], build_cmd: List[str], env: Dict[str, str]) -> str:
+    """Computes a fingerprint of everything that feeds the Rust DXE Core build.
+
+    Covers the build command, the RUST*/CARGO*/C compiler environment variables,
+    every file in the given repositories (skipping .git and target) and in any
+    path dependency outside them, the .cargo/config files cargo would read, and
+    the installed rustup toolchains. Files are hashed by path, size and
+    modification time, so only Cargo.toml contents have to be read (for path
+    dependencies). Git dependencies are pinned by the hashed Cargo.lock.
+
+    Args:
+        repos (List[Path]): The patina-dxe-core-qemu repo and any --crate-patch repos.
+        build_cmd (List[str]): The build command, so feature changes invalidate the fingerprint.
+        env (Dict[str, str]): The environment cargo is run with.
+
+    Returns:
+        str: The hex digest of the fingerprint.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\0".join(map(str, build_cmd)).encode())
+    for name in sorted(env):
+        if name.startswith(FINGERPRINT_ENV_PREFIXES):
+            digest.update(f"{name}={env[name]}\n".encode())
+
+    roots = [Path(repo).resolve() for repo in repos]
+    cargo_home = Path(env.get("CARGO_HOME") or Path.home() / ".cargo")
+    rustup_home = Path(env.get("RUSTUP_HOME") or Path.home() / ".rustup")
+    config_dirs = {d / ".cargo" for root in roots for d in (root, *root.parents)} | {cargo_home}
+    for config in sorted(d / name for d in config_dirs for name in ("config", "config.toml")):
+        if config.is_file():
+            digest.update(_stat_line(os.fspath(config)).encode())
+    if (rustup_home / "toolchains").is_dir():
+        for toolchain in sorted((rustup_home / "toolchains").iterdir()):
+            digest.update(_stat_line(os.fspath(toolchain)).encode())
+
+    walked: List[Path] = []
+    pending = roots[::-1]
+    while pending:
+        root = pending.pop()
+        if not root.is_dir() or any(root.is_relative_to(done) for done in walked):
+            continue
+        walked.append(root)
+        dirs = [os.fspath(root)]
+        while dirs:
+            with os.scandir(dirs.pop()) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in FINGERPRINT_SKIP_DIRS:
+                        dirs.append(entry.path)
+                    continue
+                try:
+                    digest.update(_stat_line(entry.path).encode())
+                except OSError:
+                    continue  # dangling symlink
+                if entry.name == "Cargo.toml":
+                    manifest = Path(entry.path)
+                    for dep in _PATH_DEP_RE.findall(manifest.read_text(errors="ignore")):
+                        pending.append((manifest.parent / dep).resolve())
+    return digest.hexdigest()
+
+
 def _normalize_platform(value: str) -> str:
     """Normalizes a user-supplied --platform value to the canonical internal name.
 
@@ -59,6 +231,21 @@ def _normalize_platform(value: str) -> str:
     return aliases[normalized]
 
 
+def _normalize_platforms(value: str) -> List[str]:
+    """Normalizes a comma-separated --platform value, e.g. "Q35,ArmVirt", dropping duplicates."""
+    return list(dict.fromkeys(_normalize_platform(platform) for platform in value.split(",")))
+
+
+class _PlatformsAction(argparse.Action):
+    """Collects the platforms of repeated --platform options, replacing the default on first use."""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        platforms = getattr(namespace, self.dest)
+        if platforms is self.default:
+            platforms = []
+        setattr(namespace, self.dest, list(dict.fromkeys([*platforms, *values])))
+
+
 def _parse_arguments() -> argparse.Namespace:
     """
     Parses command-line arguments for building and running Rust DXE Core.
@@ -68,8 +255,9 @@ def _parse_arguments() -> argparse.Namespace:
         --fw-patch-repo (Path): Path to the firmware patch repository. Default is "../patina-fw-patcher".
         --build-target (str): Build target, either DEBUG or RELEASE. Default is "DEBUG".
         --no-build (bool): Skip building the Rust DXE Core and use the pre-built binary. Default is False.
-        --platform (str): QEMU platform such as Q35 or ArmVirt. Default is "Q35".
+        --platform (List[str]): QEMU platforms such as Q35 or ArmVirt, repeatable or comma-separated. Default is "Q35".
         --features (str): Feature set to pass to patina-dxe-core-qemu build
+        --no-incremental (bool): Disable incremental Rust compilation. Default is False.
 
     Returns:
         argparse.Namespace: Parsed command-line arguments.
@@ -138,10 +326,14 @@ def _parse_arguments() -> argparse.Namespace:
     parser.add_argument(
         "--platform",
         "-p",
-        type=_normalize_platform,
+        type=_normalize_platforms,
+        action=_PlatformsAction,
         default="Q35",
         help="QEMU platform such as Q35 or ArmVirt. Accepts case-insensitive "
-        "aliases (e.g. 'ARM_VIRT', 'ArmVirt', 'ARMVIRT').",
+        "aliases (e.g. 'ARM_VIRT', 'ArmVirt', 'ARMVIRT'). Can be repeated or given "
+        "comma-separated (e.g. '-p Q35 -p ArmVirt' or '-p Q35,ArmVirt'); all platforms "
+        "are built and patched before QEMU runs for each in turn. --config-file, "
+        "--pre-compiled-rom, --custom-efi and --os apply to a single platform only.",
     )
     parser.add_argument(
         "--os",
@@ -180,6 +372,13 @@ def _parse_arguments() -> argparse.Namespace:
         "For example, the binary in the target binary directory relative to "
         "--patina-dxe-core-repo.",
     )
+    parser.add_argument(
+        "--no-incremental",
+        action="store_true",
+        default=False,
+        help="Build the Rust DXE Core with CARGO_INCREMENTAL=0. This is implied when "
+        "sccache is found on PATH.",
+    )
     parser.add_argument(
         "--do-not-exit-on-patina-test-failure",
         action="store_true",
@@ -208,9 +407,57 @@ def _parse_arguments() -> argparse.Namespace:
     )
 
     args = parser.parse_args()
+    if len(args.platform) > 1:
+        for name in ("config_file", "pre_compiled_rom", "custom_efi", "os"):
+            if getattr(args, name) is not None:
+                parser.error(f"--{name.replace('_', '-')} applies to a single platform")
     return args
 
 
+@functools.lru_cache(maxsize=None)
+def _resolved_qemu(platform: str, qemu_path: Optional[Path]) -> Tuple[str, str]:
+    """Resolves the QEMU executable and data directory to use for a platform.
+
+    On POSIX, the QEMU in /usr/local is preferred, then the one on PATH. Cached so
+    that configuring the same platform again does not re-stat the QEMU installation
+    or re-scan PATH.
+
+    Args:
+        platform (str): The normalized platform name ("Q35" or "ARM_VIRT").
+        qemu_path (Path, optional): The --qemu-path argument, None uses the default install.
+
+    Returns:
+        Tuple[str, str]: The QEMU executable and the QEMU data directory.
+
+    Raises:
+        FileNotFoundError: If the ARM_VIRT QEMU executable does not exist.
+    """
+    win_exec, posix_exec = _QEMU_EXECUTABLES[platform]
+    if qemu_path:
+        qemu_exec = qemu_path
+        qemu_dir = str(Path(qemu_exec).parent / "share")
+    elif os.name == "nt":
+        qemu_exec = str(SCRIPT_DIR / "QemuPkg" / "Binaries" / "qemu-win_extdep" / win_exec)
+        qemu_dir = str(SCRIPT_DIR / "QemuPkg" / "Binaries" / "qemu-win_extdep" / "share")
+    else:
+        qemu_exec = f"/usr/local/bin/{posix_exec}"
+        qemu_dir = "/usr/local/share/qemu"
+        # Fall back to a QEMU on PATH (e.g. a distro package) if there is none in /usr/local
+        if not Path(qemu_exec).is_file() and (found := shutil.which(posix_exec)):
+            qemu_exec = found
+            qemu_dir = str(Path(found).parent.parent / "share" / "qemu")
+
+    if platform == "ARM_VIRT" and not Path(qemu_exec).is_file():
+        raise FileNotFoundError(f"QEMU executable not found at: {qemu_exec}")
+
+    # This is an attempt to minimize the number of script parameters and should cover most setups. If this turns
+    # out to be a problem, we can always add a QEMU_DIR script parameter.
+    if not Path(qemu_dir).is_dir():
+        qemu_dir = str(Path(qemu_exec).parent)
+
+    return qemu_exec, qemu_dir
+
+
 def _configure_settings(args: argparse.Namespace) -> Dict[str, Path]:
     """
     Configures the settings based on the provided command-line arguments.
@@ -220,21 +467,31 @@ def _configure_settings(args: argparse.Namespace) -> Dict[str, Path]:
 
     Returns:
         Dict[str, Path]: A dictionary containing the configuration settings, including:
-            - build_cmd: The command to build the Rust DXE core.
+            - build_cmd: The command to build the Rust DXE core (empty with a custom EFI).
             - build_target: The build target (e.g., RELEASE or DEBUG).
             - code_fd: The path to the QEMU platform code FD file to patch.
+            - crate_patches: The resolved --crate-patch repositories.
             - config_file: The path to the configuration file for patching (None uses default).
             - custom_efi: Whether a custom EFI file was provided.
             - efi_file: The path to the EFI file to patch.
             - fw_patch_repo: The path to the patina-fw-patcher repo.
+            - no_incremental: Whether to disable incremental Rust compilation.
             - patch_cmd: The command to patch the firmware.
             - pre_compiled_rom: The path to the pre-compiled ROM file (if provided).
             - qemu_cmd: The command to run QEMU with the specified settings.
             - qemu_path: The path to the QEMU installation (None uses default).
             - patina_dxe_core_repo: The path to the patina-dxe-core-qemu repo.
             - ref_fd: The path to the file to use as a reference for patching.
+            - ref_fd_cache: The path to the cached unpatched copy of code_fd.
             - skip_build: Whether to skip building the Rust DXE Core.
     """
+    # Deferred so --help does not pay for the Platforms package import
+    from Platforms.Common.Qemu.QemuCommandBuilder import QemuArchitecture, QemuCommandBuilder
+
+    # _parse_arguments upper-cases the build target, so it is not normalized again below
+    if args.build_target not in ("DEBUG", "RELEASE"):
+        raise ValueError(f"Unsupported build target: {args.build_target}")
+
     if args.platform == "Q35":
         if args.pre_compiled_rom:
             code_fd = args.pre_compiled_rom
@@ -243,7 +500,7 @@ def _configure_settings(args: argparse.Namespace) -> Dict[str, Path]:
                 SCRIPT_DIR
                 / "Build"
                 / "QemuQ35Pkg"
-                / f"{args.build_target.upper()}_CLANGPDB"
+                / f"{args.build_target}_CLANGPDB"
                 / "FV"
                 / "QEMUQ35_CODE.fd"
             )
@@ -253,43 +510,26 @@ def _configure_settings(args: argparse.Namespace) -> Dict[str, Path]:
         else:
             config_file = args.fw_patch_repo / "Configs" / "QemuQ35.json"
 
+        # A custom EFI is patched as is, so there is nothing to build
         if args.custom_efi:
             efi_file = args.custom_efi
+            build_cmd = []
         else:
             efi_file = (
                 args.patina_dxe_core_repo
                 / "target"
                 / "x86_64-unknown-uefi"
-                / ("release" if args.build_target.lower() == "release" else "debug")
+                / ("release" if args.build_target == "RELEASE" else "debug")
                 / "qemu_q35_dxe_core.efi"
             )
+            build_cmd = [
+                "cargo",
+                "make",
+                "q35-release" if args.build_target == "RELEASE" else "q35",
+                *(arg for p in args.crate_patch for arg in ("--crate-patch", p.resolve())),
+            ]
 
-        build_cmd = [
-            "cargo",
-            "make",
-        ]
-
-        if args.build_target.upper() == "RELEASE":
-            build_cmd.append("q35-release")
-        else:
-            build_cmd.append("q35")
-
-        for p in args.crate_patch:
-            build_cmd.append("--crate-patch ")
-            build_cmd.append(str(p.resolve()))
-
-        if args.qemu_path:
-            qemu_exec = args.qemu_path
-        elif os.name == "nt":
-            qemu_exec = str(
-                SCRIPT_DIR
-                / "QemuPkg"
-                / "Binaries"
-                / "qemu-win_extdep"
-                / "qemu-system-x86_64"
-            )
-        else:
-            qemu_exec = "/usr/local/bin/qemu-system-x86_64"
+        qemu_exec, _ = _resolved_qemu(args.platform, args.qemu_path)
 
         var_store = str(code_fd.parent / "QEMUQ35_VARS.fd")
         rom_path = str(
@@ -314,22 +554,20 @@ def _configure_settings(args: argparse.Namespace) -> Dict[str, Path]:
         )
 
         if args.shutdown_after_run:
-            shutdown_drive = _create_shutdown_drive(
-                SCRIPT_DIR / "Build" / "shutdown_drive"
-            )
+            shutdown_drive = _create_shutdown_drive(SHUTDOWN_DRIVE_DIR)
             qemu_cmd_builder = qemu_cmd_builder.with_virtual_drive(str(shutdown_drive))
 
         patch_cmd = [
             "python",
             "patch.py",
             "-c",
-            str(config_file),
+            config_file,
             "-i",
-            str(efi_file),
+            efi_file,
             "-r",
-            str(ref_fd),
+            ref_fd,
             "-o",
-            str(code_fd),
+            code_fd,
         ]
     elif args.platform == "ARM_VIRT":
         if args.pre_compiled_rom:
@@ -339,7 +577,7 @@ def _configure_settings(args: argparse.Namespace) -> Dict[str, Path]:
                 SCRIPT_DIR
                 / "Build"
                 / "QemuArmVirtPkg"
-                / f"{args.build_target.upper()}_CLANGPDB"
+                / f"{args.build_target}_CLANGPDB"
                 / "FV"
                 / "QEMU_EFI.fd"
             )
@@ -348,60 +586,26 @@ def _configure_settings(args: argparse.Namespace) -> Dict[str, Path]:
             config_file = args.config_file
         else:
             config_file = args.fw_patch_repo / "Configs" / "QemuArmVirt.json"
+        # A custom EFI is patched as is, so there is nothing to build
         if args.custom_efi:
             efi_file = args.custom_efi
+            build_cmd = []
         else:
             efi_file = (
                 args.patina_dxe_core_repo
                 / "target"
                 / "aarch64-unknown-uefi"
-                / ("release" if args.build_target.lower() == "release" else "debug")
+                / ("release" if args.build_target == "RELEASE" else "debug")
                 / "qemu_armvirt_dxe_core.efi"
             )
+            build_cmd = [
+                "cargo",
+                "make",
+                "armvirt-release" if args.build_target == "RELEASE" else "armvirt",
+                *(arg for p in args.crate_patch for arg in ("--crate-patch", p.resolve())),
+            ]
 
-        build_cmd = [
-            "cargo",
-            "make",
-        ]
-
-        if args.build_target.upper() == "RELEASE":
-            build_cmd.append("armvirt-release")
-        else:
-            build_cmd.append("armvirt")
-
-        for p in args.crate_patch:
-            build_cmd.append("--crate-patch ")
-            build_cmd.append(str(p.resolve()))
-
-        if args.qemu_path:
-            qemu_exec = args.qemu_path
-            qemu_dir = str(Path(qemu_exec).parent / "share")
-        elif os.name == "nt":
-            qemu_exec = str(
-                SCRIPT_DIR
-                / "QemuPkg"
-                / "Binaries"
-                / "qemu-win_extdep"
-                / "qemu-system-aarch64.exe"
-            )
-            qemu_dir = str(
-                SCRIPT_DIR
-                / "QemuPkg"
-                / "Binaries"
-                / "qemu-win_extdep"
-                / "share"
-            )
-        else:
-            qemu_exec = "/usr/local/bin/qemu-system-aarch64"
-            qemu_dir = "/usr/local/share/qemu"
-
-        if not Path(qemu_exec).is_file():
-            raise FileNotFoundError(f"QEMU executable not found at: {qemu_exec}")
-
-        # This is an attempt to minimize the number of script parameters and should cover most setups. If this turns
-        # out to be a problem, we can always add a QEMU_DIR script parameter.
-        if not Path(qemu_dir).is_dir():
-            qemu_dir = str(Path(qemu_exec).parent)
+        qemu_exec, qemu_dir = _resolved_qemu(args.platform, args.qemu_path)
 
         secure_fd = str(code_fd.parent / "SECURE_FLASH0.fd")
         rom_path = str(
@@ -428,22 +632,20 @@ def _configure_settings(args: argparse.Namespace) -> Dict[str, Path]:
         )
 
         if args.shutdown_after_run:
-            shutdown_drive = _create_shutdown_drive(
-                SCRIPT_DIR / "Build" / "shutdown_drive"
-            )
+            shutdown_drive = _create_shutdown_drive(SHUTDOWN_DRIVE_DIR)
             qemu_cmd_builder = qemu_cmd_builder.with_virtual_drive(str(shutdown_drive))
 
         patch_cmd = [
             "python",
             "patch.py",
             "-c",
-            str(config_file),
+            config_file,
             "-i",
-            str(efi_file),
+            efi_file,
             "-r",
-            str(ref_fd),
+            ref_fd,
             "-o",
-            str(code_fd),
+            code_fd,
         ]
     else:
         raise ValueError(f"Unsupported platform: {args.platform}")
@@ -453,29 +655,104 @@ def _configure_settings(args: argparse.Namespace) -> Dict[str, Path]:
         pass_through_args.extend(["--features", str(args.features)])
     if args.do_not_exit_on_patina_test_failure:
         pass_through_args.extend(["--exclude-features", "exit_on_patina_test_failure"])
-    if pass_through_args:
+    if pass_through_args and build_cmd:
         build_cmd.append("--")
         build_cmd.extend(pass_through_args)
 
-    (executable, qemu_args) = qemu_cmd_builder.build()
-
-    logging.info("QEMU Command: " + str(executable) + " " + " ".join(qemu_args))
     return {
         "build_cmd": build_cmd,
         "build_target": args.build_target,
         "code_fd": code_fd,
+        "crate_patches": [p.resolve() for p in args.crate_patch],
         "custom_efi": args.custom_efi is not None,
         "efi_file": efi_file,
         "fw_patch_repo": args.fw_patch_repo,
+        "no_incremental": args.no_incremental,
         "patch_cmd": patch_cmd,
-        "qemu_cmd": [executable] + qemu_args,
+        "qemu_cmd": qemu_cmd_builder.as_list(),
         "patina_dxe_core_repo": args.patina_dxe_core_repo,
         "ref_fd": ref_fd,
+        "ref_fd_cache": REF_FD_CACHE_DIR
+        / f"{hashlib.blake2b(str(code_fd.resolve()).encode(), digest_size=8).hexdigest()}.fd",
         "skip_build": args.no_build,
         "toolchain": "CLANGPDB",
     }
 
 
+def _load_settings(args: argparse.Namespace) -> Dict[str, Path]:
+    """
+    Returns the settings for args, reusing the ones from an earlier run when possible.
+
+    The settings only depend on the arguments, the working directory, this
+    script's sources and the QEMU executable found, so they are pickled under
+    SETTINGS_CACHE_DIR keyed by the first three. The QEMU executable is resolved
+    again on every run, and a cached entry that names a different one is rebuilt.
+    Only the SETTINGS_CACHE_LIMIT most recently used entries are kept. The cache is
+    not used in CI, where every run starts from a clean checkout.
+
+    code_fd changes between runs, so it is stat'ed here on every run instead, and
+    the result is stored as 'code_fd_stat' (None if it does not exist) for the
+    later steps to share.
+
+    Args:
+        args (argparse.Namespace): The command-line arguments provided to the script.
+
+    Returns:
+        Dict[str, Path]: The settings described in _configure_settings.
+    """
+    import pickle
+
+    use_cache = not os.environ.get("CI")
+    if use_cache:
+        key = hashlib.sha1(repr(sorted(vars(args).items())).encode())
+        key.update(os.getcwd().encode())
+        for source in (Path(__file__), SCRIPT_DIR / "Platforms" / "Common" / "Qemu" / "QemuCommandBuilder.py"):
+            key.update(str(source.stat().st_mtime_ns).encode())
+        cache_file = SETTINGS_CACHE_DIR / f"settings-{key.hexdigest()}.pkl"
+
+    settings = None
+    if use_cache and cache_file.is_file():
+        try:
+            with cache_file.open("rb") as f:
+                settings = pickle.load(f)
+            # A different QEMU is found now, or for ARM_VIRT none at all (raises)
+            if os.fspath(settings["qemu_cmd"][0]) != os.fspath(
+                _resolved_qemu(args.platform, args.qemu_path)[0]
+            ):
+                settings = None
+        except Exception:
+            # Truncated, written by an incompatible version of this script, or
+            # stale. Configuring from scratch reports any real error.
+            settings = None
+
+    if settings is None:
+        settings = _configure_settings(args)
+        if use_cache:
+            SETTINGS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            with cache_file.open("wb") as f:
+                pickle.dump(settings, f)
+            try:
+                entries = sorted(SETTINGS_CACHE_DIR.glob("settings-*.pkl"), key=lambda p: p.stat().st_mtime_ns)
+                for old in entries[:-SETTINGS_CACHE_LIMIT]:
+                    old.unlink(missing_ok=True)
+            except OSError:
+                pass  # another run is pruning the cache at the same time
+    else:
+        # Marks the entry as recently used for the eviction above
+        os.utime(cache_file)
+        if args.shutdown_after_run:
+            # The drive lives in Build and may have been cleaned since it was cached
+            _create_shutdown_drive(SHUTDOWN_DRIVE_DIR)
+
+    try:
+        settings["code_fd_stat"] = settings["code_fd"].stat()
+    except FileNotFoundError:
+        settings["code_fd_stat"] = None
+
+    logging.info("QEMU Command: " + shlex.join(map(os.fspath, settings["qemu_cmd"])))
+    return settings
+
+
 def _print_configuration(settings: Dict[str, Path]) -> None:
     """
     Prints the current configuration settings.
@@ -510,27 +787,88 @@ def _build_rust_dxe_core(settings: Dict[str, Path]) -> None:
     """
     Build the Rust DXE Core based on the provided settings.
 
+    If sccache is on PATH it is used as the rustc wrapper (unless RUSTC_WRAPPER is
+    already set to a non-empty value) and incremental compilation is turned off,
+    as incremental artifacts are not cacheable and only add I/O when a shared
+    compiler cache is in use. This is the same setup rust-analyzer uses for its CI builds.
+
+    The build is skipped when its inputs (see _source_fingerprint) and the EFI's
+    size and modification time match what the last successful build recorded, so an
+    EFI rebuilt or replaced outside this script is never patched in as-is.
+
     Args:
         settings (Dict[str, Path]): A dictionary containing the build settings.
             - 'build_cmd' (Path): The command to execute for building the Rust DXE Core.
             - 'build_target' (str): The target build type.
+            - 'crate_patches' (List[Path]): Additional repositories the build is patched with.
+            - 'efi_file' (Path): The EFI file the build produces.
+            - 'no_incremental' (bool): Whether to disable incremental compilation.
     """
     logging.info("[1]. Building Rust DXE Core...\n")
 
+    env = os.environ.copy()
+    if not env.get("RUSTC_WRAPPER"):
+        # An empty RUSTC_WRAPPER means no wrapper, the same as an unset one
+        env.pop("RUSTC_WRAPPER", None)
+    if shutil.which("sccache"):
+        env.setdefault("RUSTC_WRAPPER", "sccache")
+        env["CARGO_INCREMENTAL"] = "0"
+        logging.info(f"Using {env['RUSTC_WRAPPER']} as the rustc wrapper.")
+    if settings["no_incremental"]:
+        env["CARGO_INCREMENTAL"] = "0"
+
+    efi_file = settings["efi_file"]
+    fingerprint_file = efi_file.with_suffix(".efi.fingerprint")
+    fingerprint = _source_fingerprint(
+        [settings["patina_dxe_core_repo"], *settings["crate_patches"]],
+        settings["build_cmd"],
+        env,
+    )
+    try:
+        efi_stamp = _fd_stamp(efi_file.stat())
+    except FileNotFoundError:
+        efi_stamp = None
+    if (
+        efi_stamp is not None
+        and fingerprint_file.is_file()
+        and fingerprint_file.read_text() == f"{fingerprint}\n{efi_stamp}"
+    ):
+        logging.info("Rust build inputs unchanged since the last build, skipping cargo.\n")
+        return
+
     # Run from the patina-dxe-core-qemu directory so that rustup picks up its
-    # rust-toolchain.toml.
+    # rust-toolchain.toml. Output is forwarded line by line so it shows up as the
+    # build progresses, even when stdout is not a terminal.
+    #
+    # Keep preexec_fn, start_new_session, user and group off the subprocess calls in
+    # this script: without them CPython (3.10+) starts children with vfork() instead
+    # of fork(), so launching does not copy this interpreter's page tables.
     try:
-        subprocess.run(
+        with subprocess.Popen(
             settings["build_cmd"],
-            check=True,
             cwd=settings["patina_dxe_core_repo"],
-        )
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
+        ) as proc:
+            for line in proc.stdout:
+                logging.info(line.rstrip())
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, settings["build_cmd"])
     except subprocess.CalledProcessError as e:
         logging.error(f"Build failed with error #{e.returncode}.")
         sys.exit(e.returncode)
 
+    if efi_file.exists():
+        fingerprint_file.write_text(f"{fingerprint}\n{_fd_stamp(efi_file.stat())}")
+
 
-def _patch_rust_binary(settings: Dict[str, Path]) -> None:
+def _patch_rust_binary(
+    settings: Dict[str, Path], ref_copy: Optional["concurrent.futures.Future"] = None
+) -> None:
     """
     Patches the binary by copying the reference firmware directory if it does not exist
     and running the specified patch command.
@@ -538,52 +876,154 @@ def _patch_rust_binary(settings: Dict[str, Path]) -> None:
     Args:
         settings (Dict[str, Path]): A dictionary containing the following keys:
             - 'code_fd': Path to patch output FD file.
+            - 'code_fd_stat': The stat of code_fd, refreshed here after patching.
             - 'custom_efi': Whether a custom EFI file was provided.
             - 'fw_patch_repo': Path to the patina-fw-patcher repo.
             - 'patch_cmd': Command to run for patching.
             - 'ref_fd': Path to patch input (reference) FD file.
+            - 'ref_fd_cache': Path to the cached unpatched copy of code_fd.
+        ref_copy (Future, optional): A _prepare_ref_fd call that was already
+            started in the background. If None, the reference is prepared here.
     """
     logging.info(
         f"[2]. Patching {'Custom EFI' if settings['custom_efi'] else 'Rust DXE Core'}...\n"
     )
 
-    shutil.copy(settings["code_fd"], settings["ref_fd"])
+    if ref_copy is None:
+        _prepare_ref_fd(settings)
+    else:
+        ref_copy.result()
 
-    subprocess.run(settings["patch_cmd"], cwd=settings["fw_patch_repo"], check=True)
+    _run_patcher(settings["patch_cmd"], settings["fw_patch_repo"])
     settings["ref_fd"].unlink()
 
+    # code_fd is now the patch output of the cached reference
+    settings["code_fd_stat"] = settings["code_fd"].stat()
+    settings["ref_fd_cache"].with_suffix(".stamp").write_text(_fd_stamp(settings["code_fd_stat"]))
 
-def _run_qemu(settings: Dict[str, Path]) -> None:
+
+def _run_patcher(patch_cmd: List[Union[str, Path]], fw_patch_repo: Path) -> None:
+    """Runs patch.py inside this interpreter to avoid a second Python startup.
+
+    The patcher sees the same argv, sys.path and working directory it would get as
+    `python patch.py` run from fw_patch_repo. Path arguments are resolved first, as
+    they are relative to this script's working directory. Modules loaded from the
+    patcher repo are unloaded afterwards, so each platform in a multi-platform run
+    starts from a fresh import.
+
+    Args:
+        patch_cmd (List[Union[str, Path]]): The patch command, starting with "python", "patch.py".
+        fw_patch_repo (Path): The path to the patina-fw-patcher repo.
+
+    Raises:
+        subprocess.CalledProcessError: If the patcher exits non-zero or raises.
     """
-    Runs QEMU with the specified settings.
+    import runpy
+
+    fw_patch_repo = fw_patch_repo.resolve()
+    script = fw_patch_repo / patch_cmd[1]
+    saved_argv, saved_path, saved_cwd = sys.argv, sys.path[:], os.getcwd()
+    saved_modules = set(sys.modules)
+    sys.argv = [
+        str(script),
+        *(os.fspath(arg.resolve()) if isinstance(arg, Path) else arg for arg in patch_cmd[2:]),
+    ]
+    sys.path.insert(0, str(fw_patch_repo))
+    os.chdir(fw_patch_repo)
+    try:
+        runpy.run_path(str(script), run_name="__main__")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise subprocess.CalledProcessError(e.code if isinstance(e.code, int) else 1, patch_cmd) from e
+    except Exception as e:
+        logging.exception("patch.py failed.")
+        raise subprocess.CalledProcessError(1, patch_cmd) from e
+    finally:
+        sys.argv, sys.path[:] = saved_argv, saved_path
+        for name in set(sys.modules) - saved_modules:
+            module_file = getattr(sys.modules[name], "__file__", None)
+            if module_file and Path(module_file).resolve().is_relative_to(fw_patch_repo):
+                del sys.modules[name]
+        os.chdir(saved_cwd)
+
 
+def _save_console_mode() -> Tuple[Optional[int], int]:
     """
-    logging.info("[3]. Running QEMU with Patched Binary...\n")
-    if os.name == "nt":
+    Returns the Windows stdin console handle and its current mode.
+
+    Returns:
+        Tuple[Optional[int], int]: The handle and mode, or (None, 0) when stdin is not a console.
+    """
+    import ctypes
+
+    kernel32 = ctypes.windll.kernel32
+    STD_INPUT_HANDLE = -10
+    std_handle = kernel32.GetStdHandle(STD_INPUT_HANDLE)
+    original_mode = ctypes.c_uint()
+    if not std_handle or not kernel32.GetConsoleMode(std_handle, ctypes.byref(original_mode)):
+        return None, 0
+    return std_handle, original_mode.value
+
+
+def _restore_console_mode(std_handle: Optional[int], original_mode: int) -> None:
+    """
+    Restores a console mode saved by _save_console_mode. Safe to call more than once.
+
+    Args:
+        std_handle (Optional[int]): The console handle, None if there is no console.
+        original_mode (int): The console mode to restore.
+    """
+    if std_handle and original_mode:
         import ctypes
 
-        kernel32 = ctypes.windll.kernel32
-        STD_INPUT_HANDLE = -10
-        std_handle = kernel32.GetStdHandle(STD_INPUT_HANDLE)
-        original_mode = ctypes.c_uint()
-        if std_handle != 0:
-            if not kernel32.GetConsoleMode(std_handle, ctypes.byref(original_mode)):
-                std_handle = None
+        ctypes.windll.kernel32.SetConsoleMode(std_handle, original_mode)
+
 
+def _run_qemu(settings: Dict[str, Path]) -> None:
+    """
+    Runs QEMU with the specified settings.
+
+    Args:
+        settings (Dict[str, Path]): A dictionary containing the 'qemu_cmd' to run.
+    """
+    import atexit
+    import signal
+
+    logging.info("[3]. Running QEMU with Patched Binary...\n")
     # Known benign QEMU exit codes:
     #   0xC00000FD (STATUS_STACK_OVERFLOW)   - QEMU on Windows after guest reset -s
     #   33                                   - QEMU isa-debug-exit success value
     BENIGN_QEMU_EXIT_CODES = {0xC00000FD, 33}
 
+    console = None
+    if os.name == "nt":
+        # Restore the console mode for Windows as QEMU garbles it. This is done after
+        # every run so the next platform starts from a clean console, and also at exit
+        # because Ctrl-Break would otherwise end the interpreter without unwinding.
+        console = _save_console_mode()
+        atexit.register(_restore_console_mode, *console)
+
+        def _interrupt(signum, frame):
+            _restore_console_mode(*console)
+            raise KeyboardInterrupt
+
+        previous_handlers = {sig: signal.signal(sig, _interrupt) for sig in (signal.SIGINT, signal.SIGBREAK)}
+    else:
+        # Leave Ctrl-C to QEMU and report its exit code. A Python handler does not
+        # survive exec, so QEMU itself still gets the default SIGINT behavior.
+        previous_handlers = {signal.SIGINT: signal.signal(signal.SIGINT, lambda signum, frame: None)}
+
     try:
         subprocess.run(settings["qemu_cmd"], check=True)
     except subprocess.CalledProcessError as e:
         if e.returncode not in BENIGN_QEMU_EXIT_CODES:
             raise
     finally:
-        if os.name == "nt" and std_handle and original_mode.value:
-            # Restore the console mode for Windows as QEMU garbles it
-            kernel32.SetConsoleMode(std_handle, original_mode.value)
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+        if console is not None:
+            _restore_console_mode(*console)
+            atexit.unregister(_restore_console_mode)
 
 
 def main() -> None:
@@ -591,7 +1031,9 @@ def main() -> None:
     Main function to build, patch, and run the Rust DXE core.
 
     """
-    start_time = timeit.default_timer()
+    import concurrent.futures
+
+    start_ns = time.perf_counter_ns()
 
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.DEBUG)
@@ -607,30 +1049,54 @@ def main() -> None:
     args = _parse_arguments()
 
     try:
-        settings = _configure_settings(args)
+        settings_list = [
+            _load_settings(argparse.Namespace(**{**vars(args), "platform": platform}))
+            for platform in args.platform
+        ]
     except ValueError as e:
         logging.error(f"Error: {e}")
         exit(1)
 
-    _print_configuration(settings)
+    for settings in settings_list:
+        _print_configuration(settings)
 
     try:
-        if not settings["custom_efi"] and not settings["skip_build"]:
-            build_start_time = timeit.default_timer()
-            _build_rust_dxe_core(settings)
-            build_end_time = timeit.default_timer()
-            logging.info(
-                f"Rust DXE Core Build Time: {build_end_time - build_start_time:.2f} seconds.\n"
-            )
-        elif settings["skip_build"]:
-            logging.info("[1]. Skipping build, using pre-built binary.\n")
-
-        _patch_rust_binary(settings)
-        end_time = timeit.default_timer()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(settings_list)) as executor:
+            # The reference FD copies only read code_fd, which the Rust builds do
+            # not touch, so let the disk I/O run while cargo compiles.
+            ref_copies = [
+                executor.submit(_prepare_ref_fd, settings) if settings["code_fd_stat"] is not None else None
+                for settings in settings_list
+            ]
+
+            try:
+                # cargo serializes builds in the same workspace on its own lock, so the
+                # platforms are built back to back and each build uses all cores.
+                for settings in settings_list:
+                    if settings["build_cmd"] and not settings["skip_build"]:
+                        build_start_ns = time.perf_counter_ns()
+                        _build_rust_dxe_core(settings)
+                        logging.info(
+                            f"Rust DXE Core Build Time: {(time.perf_counter_ns() - build_start_ns) / 1e9:.2f} seconds.\n"
+                        )
+                    elif settings["skip_build"]:
+                        logging.info("[1]. Skipping build, using pre-built binary.\n")
+            except BaseException:
+                # Do not leave the reference copies behind if a build fails
+                for settings, ref_copy in zip(settings_list, ref_copies):
+                    if ref_copy is not None and ref_copy.exception() is None:
+                        settings["ref_fd"].unlink(missing_ok=True)
+                raise
+
+            # patch.py runs in this interpreter and changes its working directory,
+            # so the patches are applied one at a time.
+            for settings, ref_copy in zip(settings_list, ref_copies):
+                _patch_rust_binary(settings, ref_copy)
         logging.info(
-            f"Total time to get to kick off QEMU: {end_time - start_time:.2f} seconds.\n"
+            f"Total time to get to kick off QEMU: {(time.perf_counter_ns() - start_ns) / 1e9:.2f} seconds.\n"
         )
-        _run_qemu(settings)
+        for settings in settings_list:
+            _run_qemu(settings)
     except subprocess.CalledProcessError as e:
         logging.error(f"Failed with error #{e.returncode}.")
         exit(e.returncode)